@@ -0,0 +1,389 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import trail_store
+from recommender_index import RecommendationIndex, FEATURE_COLS
+
+# inverted lists probed per query, the recall / latency knob -- see the report for operating points
+N_PROBE = 8
+# k-means is trained on at most this many points per list, plenty for stable centroids
+TRAIN_PER_LIST = 256
+KMEANS_ITERS = 20
+# product quantizer codebook size, so each sub-vector is stored as one byte
+PQ_CENTROIDS = 256
+# shortlist re-ranked with exact distances, as a multiple of k, when PQ vectors are kept
+RERANK_FACTOR = 4
+# rows per block when assigning vectors to their nearest centroid
+ASSIGN_BLOCK = 65536
+# rebuild from scratch instead of inserting once this share of the index was added after training
+RETRAIN_FRACTION = 0.5
+# -----------------------------------------------------
+# coarse quantizer
+def nearest_centroid(X, centroids, block=ASSIGN_BLOCK):
+    # squared distances ||x||^2 - 2xc + ||c||^2, a block of rows at a time
+    c_norms = (centroids.astype(np.float64) ** 2).sum(axis=1)
+    labels = np.empty(len(X), dtype=np.int32)
+    for start in range(0, len(X), block):
+        part = X[start:start+block].astype(np.float64)
+        labels[start:start+block] = np.argmin(c_norms[None, :] - 2 * part @ centroids.T, axis=1)
+    return labels
+
+def kmeans(X, k, iters=KMEANS_ITERS, seed=0, max_points=None):
+    """Lloyd's k-means on (a sample of) X, empty clusters reseeded from random points."""
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    if max_points is not None and len(X) > max_points:
+        X = X[rng.choice(len(X), max_points, replace=False)]
+    k = min(k, len(X))
+    centroids = X[rng.choice(len(X), k, replace=False)].astype(np.float64)
+    for _ in range(iters):
+        labels = nearest_centroid(X, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, X)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = X[rng.choice(len(X), int(empty.sum()), replace=False)]
+    return centroids.astype(np.float32)
+# -----------------------------------------------------
+# product quantizer: each vector split into m sub-vectors, each stored as its nearest codebook entry
+class ProductQuantizer:
+    def __init__(self, codebooks):
+        # (m, PQ_CENTROIDS, d / m)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+        self.m, self.ksub, self.dsub = self.codebooks.shape
+
+    @classmethod
+    def train(cls, X, m, seed=0):
+        if X.shape[1] % m:
+            raise ValueError(f"{X.shape[1]} features do not split into {m} sub-vectors")
+        dsub = X.shape[1] // m
+        return cls([kmeans(X[:, j*dsub:(j+1)*dsub], PQ_CENTROIDS, seed=seed + j, max_points=PQ_CENTROIDS * TRAIN_PER_LIST)
+                    for j in range(m)])
+
+    def encode(self, X):
+        codes = np.empty((len(X), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = nearest_centroid(X[:, j*self.dsub:(j+1)*self.dsub], self.codebooks[j])
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def tables(self, q):
+        # squared distance from each sub-vector of q to every codebook entry, (m, ksub)
+        return ((self.codebooks - q.reshape(self.m, 1, self.dsub)) ** 2).sum(axis=2)
+
+    def distances(self, tables, codes):
+        # asymmetric distance: exact query, quantized database
+        return tables[np.arange(self.m), codes].sum(axis=1)
+# -----------------------------------------------------
+# IVF index over the standardized trail features, built and updated by the batch job below
+class IVFIndex:
+    """Approximate nearest neighbours: k-means inverted lists, optionally product quantized.
+
+    A query scans only the n_probe lists whose centroids are closest, so its cost
+    is roughly n_probe / n_lists of a full scan. With PQ each trail costs m bytes
+    instead of 4 * n_features; keep_vectors additionally keeps the float32 vectors
+    so the PQ shortlist can be re-ranked exactly. Row ids are positions in the
+    dataset, like everywhere else, and add() continues them.
+    """
+    def __init__(self, centroids, pq=None, n_probe=N_PROBE, keep_vectors=True, meta=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.pq = pq
+        self.n_probe = n_probe
+        self.meta = meta or {}
+        self.labels = np.empty(0, dtype=np.int32)
+        self.codes = np.empty((0, pq.m), dtype=np.uint8) if pq is not None else None
+        self.vectors = np.empty((0, self.centroids.shape[1]), dtype=np.float32) if keep_vectors or pq is None else None
+        self.lists = [np.empty(0, dtype=np.int32) for _ in range(len(self.centroids))]
+        # per-row (name, name + features) hashes of the catalog it was built from, see build_ann
+        self.keys = None
+
+    @classmethod
+    def train(cls, X, n_lists=None, pq_m=None, n_probe=N_PROBE, keep_vectors=None, seed=0):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_lists = n_lists or max(1, int(np.sqrt(len(X))))
+        start = time.perf_counter()
+        centroids = kmeans(X, n_lists, seed=seed, max_points=n_lists * TRAIN_PER_LIST)
+        pq = None
+        if pq_m:
+            # PQ codes the residual to the list centroid, which is far smaller than the vector itself
+            sample = X[np.random.default_rng(seed).permutation(len(X))[:PQ_CENTROIDS * TRAIN_PER_LIST]]
+            pq = ProductQuantizer.train(sample - centroids[nearest_centroid(sample, centroids)], pq_m, seed=seed)
+        index = cls(centroids, pq, n_probe=n_probe, keep_vectors=keep_vectors if keep_vectors is not None else pq is None,
+                    meta={'n_lists': len(centroids), 'pq_m': pq_m, 'trained_rows': len(X), 'inserted_rows': 0, 'seed': seed})
+        index.add(X)
+        index.meta['inserted_rows'] = 0
+        index.meta['train_seconds'] = round(time.perf_counter() - start, 3)
+        return index
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        arrays = [self.centroids, self.labels, self.codes, self.vectors] + self.lists
+        return sum(a.nbytes for a in arrays if a is not None) + (self.pq.codebooks.nbytes if self.pq is not None else 0)
+
+    def add(self, X):
+        """Insert trails with row ids len(self), len(self)+1, ... without retraining anything."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        ids = np.arange(len(self), len(self) + len(X), dtype=np.int32)
+        labels = nearest_centroid(X, self.centroids)
+        self.labels = np.concatenate([self.labels, labels])
+        if self.pq is not None:
+            self.codes = np.concatenate([self.codes, self.pq.encode(X - self.centroids[labels])])
+        if self.vectors is not None:
+            self.vectors = np.concatenate([self.vectors, X])
+        self._append(ids, labels)
+
+    def update(self, rows, X):
+        """Re-insert existing trails whose features changed, keeping their row ids."""
+        rows = np.asarray(rows, dtype=np.int32)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        for c in np.unique(self.labels[rows]):
+            self.lists[c] = np.setdiff1d(self.lists[c], rows, assume_unique=True)
+        labels = nearest_centroid(X, self.centroids)
+        self.labels[rows] = labels
+        if self.pq is not None:
+            self.codes[rows] = self.pq.encode(X - self.centroids[labels])
+        if self.vectors is not None:
+            self.vectors[rows] = X
+        self._append(rows, labels)
+
+    def _append(self, ids, labels):
+        # one concatenate per list that gained trails
+        order = np.argsort(labels, kind='stable')
+        touched, starts = np.unique(labels[order], return_index=True)
+        for c, group in zip(touched, np.split(ids[order], starts[1:])):
+            self.lists[c] = np.concatenate([self.lists[c], group])
+        self.meta['inserted_rows'] = self.meta.get('inserted_rows', 0) + len(ids)
+
+    def vector(self, row):
+        if self.vectors is not None:
+            return self.vectors[row]
+        return self.centroids[self.labels[row]] + self.pq.decode(self.codes[row:row+1])[0]
+
+    def _scan(self, q, probes):
+        # candidate ids in the probed lists with their (approximate) squared distances
+        ids = np.concatenate([self.lists[c] for c in probes])
+        if self.pq is None:
+            return ids, ((self.vectors[ids] - q) ** 2).sum(axis=1)
+        dist = [self.pq.distances(self.pq.tables(q - self.centroids[c]), self.codes[self.lists[c]]) for c in probes]
+        return ids, np.concatenate(dist) if dist else np.empty(0, dtype=np.float32)
+
+    def query(self, row, k, mask=None, n_probe=None, q=None):
+        """Row ids and distances of (approximately) the k trails closest to `row`.
+
+        Same contract as RecommendationIndex.query: only rows where mask is True are
+        returned, ordered by distance with ties broken by row id. When the mask leaves
+        too few candidates in the probed lists, more lists are probed.
+        """
+        n = len(self)
+        n_allowed = n if mask is None else int(np.count_nonzero(mask))
+        k = min(k, n_allowed)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        q = self.vector(row) if q is None else np.asarray(q, dtype=np.float32)
+        n_lists = len(self.centroids)
+        n_probe = min(n_lists, n_probe or self.n_probe)
+        ranked = np.argsort(((self.centroids - q) ** 2).sum(axis=1))
+        while True:
+            ids, dist = self._scan(q, ranked[:n_probe])
+            if mask is not None:
+                keep = mask[ids]
+                ids, dist = ids[keep], dist[keep]
+            if len(ids) >= k or n_probe == n_lists:
+                break
+            n_probe = min(n_lists, n_probe * 2)
+        if self.pq is not None and self.vectors is not None and len(ids) > k:
+            # re-rank the best of the quantized distances exactly
+            short = np.argpartition(dist, min(len(ids), k * RERANK_FACTOR) - 1)[:k * RERANK_FACTOR]
+            ids = ids[short]
+            dist = ((self.vectors[ids] - q) ** 2).sum(axis=1)
+        dist = np.sqrt(np.maximum(dist, 0))
+        order = np.lexsort((ids, dist))[:k]
+        return ids[order].astype(np.intp), dist[order].astype(np.float32)
+
+    def query_batch(self, rows, k, mask=None, n_probe=None):
+        return [self.query(row, k, mask=mask, n_probe=n_probe) for row in rows]
+
+    def save(self, path):
+        arrays = {'centroids': self.centroids, 'labels': self.labels, 'codes': self.codes, 'vectors': self.vectors,
+                  'codebooks': self.pq.codebooks if self.pq is not None else None, 'keys': self.keys}
+        for name, array in arrays.items():
+            if array is not None:
+                tmp = os.path.join(path, f".ann.{name}.npy")
+                np.save(tmp, array)
+                os.replace(tmp, os.path.join(path, f"ann.{name}.npy"))
+        meta = dict(self.meta, n_probe=self.n_probe, rows=len(self), arrays=[k for k, a in arrays.items() if a is not None])
+        with open(os.path.join(path, 'ann.json'), 'w') as f:
+            json.dump(meta, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        # None if the batch job has not been run for this dataset version yet
+        if not os.path.exists(os.path.join(path, 'ann.json')):
+            return None
+        with open(os.path.join(path, 'ann.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"ann.{name}.npy")) for name in meta['arrays']}
+        pq = ProductQuantizer(arrays['codebooks']) if 'codebooks' in arrays else None
+        index = cls(arrays['centroids'], pq, n_probe=meta['n_probe'], keep_vectors='vectors' in arrays, meta=meta)
+        index.labels = arrays['labels']
+        index.codes = arrays.get('codes')
+        index.vectors = arrays.get('vectors')
+        order = np.argsort(index.labels, kind='stable').astype(np.int32)
+        index.lists = np.split(order, np.cumsum(np.bincount(index.labels, minlength=len(index.centroids)))[:-1])
+        index.keys = arrays.get('keys')
+        return index
+# -----------------------------------------------------
+# batch job: build alongside the compiled store, or extend the previous version's index with the new trails
+def row_keys(df):
+    # two hashes per trail: its name, to tell whether a new catalog only appended trails to an old one,
+    # and its name with the features, to find the trails a re-scrape changed
+    names = pd.util.hash_array(df['name'].astype(str).to_numpy(dtype=object))
+    rows = pd.util.hash_pandas_object(df[['name'] + FEATURE_COLS], index=False).to_numpy()
+    return np.column_stack([names, rows])
+
+def _previous(csv_path, path):
+    # the newest earlier version that has an index -- store versions sort oldest to newest
+    root = trail_store.store_root(csv_path)
+    builds = sorted(os.path.join(root, d) for d in os.listdir(root))
+    for build in reversed([d for d in builds if os.path.isdir(d) and d != path]):
+        index = IVFIndex.load(build)
+        if index is not None:
+            return index
+    return None
+
+def build_ann(csv_path, n_lists=None, pq_m=None, n_probe=N_PROBE, keep_vectors=None, update=True, seed=0):
+    """IVF index for the dataset version load_frame serves, saved into its store directory.
+
+    With update=True, when the newest earlier index covers a prefix of this catalog
+    (new trails are appended by the scraper), only the new trails and the ones whose
+    features changed are inserted, using that index's feature scaling. It is
+    retrained once more than RETRAIN_FRACTION of it was inserted after training.
+    """
+    path = trail_store.resolve_store(csv_path)
+    df = trail_store.load_frame(csv_path)
+    raw = df[FEATURE_COLS].to_numpy(dtype=np.float64)
+    keys = row_keys(df)
+    previous = _previous(csv_path, path) if update else None
+    # indexes saved before the feature hashes were kept cannot tell which trails changed
+    prefix = previous is not None and previous.keys is not None and previous.keys.ndim == 2 and len(previous) <= len(df) \
+        and np.array_equal(previous.keys[:, 0], keys[:len(previous), 0])
+    changed = np.flatnonzero(previous.keys[:, 1] != keys[:len(previous), 1]) if prefix else None
+    if prefix and previous.meta['inserted_rows'] + len(changed) + len(df) - len(previous) \
+            <= RETRAIN_FRACTION * previous.meta['trained_rows']:
+        start = time.perf_counter()
+        mean, scale = np.array(previous.meta['mean']), np.array(previous.meta['scale'])
+        if len(changed):
+            previous.update(changed, (raw[changed] - mean) / scale)
+        previous.add((raw[len(previous):] - mean) / scale)
+        previous.meta['insert_seconds'] = round(time.perf_counter() - start, 3)
+        index = previous
+    else:
+        mean, scale = raw.mean(axis=0), raw.std(axis=0)
+        scale[scale == 0] = 1
+        index = IVFIndex.train((raw - mean) / scale, n_lists=n_lists, pq_m=pq_m, n_probe=n_probe,
+                               keep_vectors=keep_vectors, seed=seed)
+        index.meta.update(mean=mean.tolist(), scale=scale.tolist(), features=FEATURE_COLS)
+    index.keys = keys
+    index.meta['source_version'] = trail_store.open_store(path).version
+    index.save(path)
+    return index
+
+def load_ann(csv_path):
+    index = IVFIndex.load(trail_store.resolve_store(csv_path))
+    return index if index is not None and len(index) == len(trail_store.load_frame(csv_path)) else None
+# -----------------------------------------------------
+# recall@k and latency against the exact engine, to pick n_lists / n_probe / PQ operating points
+def _latency(fn, rows):
+    times = []
+    results = []
+    for row in rows:
+        start = time.perf_counter()
+        results.append(fn(row))
+        times.append(time.perf_counter() - start)
+    times = np.asarray(times) * 1000
+    return results, {'mean_ms': round(float(times.mean()), 4), 'p50_ms': round(float(np.median(times)), 4),
+                     'p95_ms': round(float(np.percentile(times, 95)), 4)}
+
+def recall_report(X, k=10, queries=500, probes=(1, 2, 4, 8, 16, 32), n_lists=None, pq_m=None,
+                  keep_vectors=None, holdout=0.1, seed=0):
+    """Train on X (inserting the last `holdout` share afterwards) and compare against exact search.
+
+    Returns a dict with the build cost, memory, the exact engines' latency and,
+    for every probe count, recall@k (overlap with the exact top k) and latency.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    n_train = len(X) - int(len(X) * holdout)
+    start = time.perf_counter()
+    index = IVFIndex.train(X[:n_train], n_lists=n_lists, pq_m=pq_m, keep_vectors=keep_vectors, seed=seed)
+    train_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index.add(X[n_train:])
+    insert_seconds = time.perf_counter() - start
+    exact = RecommendationIndex(X)
+    rows = rng.integers(0, len(X), queries)
+    truth, kd_latency = _latency(lambda row: exact.query(row, k)[0], rows)
+    # the original design: distances to every trail, then a full sort
+    _, scan_latency = _latency(lambda row: np.argsort(((X - X[row]) ** 2).sum(axis=1))[:k], rows[:max(1, queries // 10)])
+    inserted = rows >= n_train
+    report = {'rows': len(X), 'features': X.shape[1], 'k': k, 'queries': queries, 'n_lists': len(index.centroids),
+              'pq_m': pq_m, 'keep_vectors': index.vectors is not None, 'train_rows': n_train,
+              'train_seconds': round(train_seconds, 3), 'insert_seconds': round(insert_seconds, 3),
+              'index_bytes': index.nbytes, 'exact_kdtree': kd_latency, 'exact_scan': scan_latency, 'probes': []}
+    for n_probe in probes:
+        if n_probe > len(index.centroids):
+            break
+        found, latency = _latency(lambda row: index.query(row, k, n_probe=n_probe, q=X[row])[0], rows)
+        hits = np.array([len(np.intersect1d(a, b)) / max(len(b), 1) for a, b in zip(found, truth)])
+        report['probes'].append(dict(n_probe=n_probe, recall=round(float(hits.mean()), 4),
+                                     recall_inserted=round(float(hits[inserted].mean()), 4) if inserted.any() else None,
+                                     **latency))
+    return report
+
+def print_report(report):
+    print(f"{report['rows']:,} trails x {report['features']} features, {report['n_lists']} lists, pq_m={report['pq_m']}, "
+          f"index {report['index_bytes']/1e6:.1f} MB, trained in {report['train_seconds']}s, "
+          f"{report['rows'] - report['train_rows']:,} inserted in {report['insert_seconds']}s")
+    print(f"  exact kd-tree {report['exact_kdtree']['mean_ms']:.3f} ms, full scan {report['exact_scan']['mean_ms']:.3f} ms per query")
+    print(f"  {'n_probe':>7} {'recall@' + str(report['k']):>10} {'inserted':>9} {'mean ms':>9} {'p95 ms':>9}")
+    for p in report['probes']:
+        print(f"  {p['n_probe']:>7} {p['recall']:>10.4f} {p['recall_inserted'] or float('nan'):>9.4f} "
+              f"{p['mean_ms']:>9.3f} {p['p95_ms']:>9.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build an IVF(-PQ) index next to the compiled store, or report its recall.')
+    parser.add_argument('csv', help='track csv the app loads, e.g. data/WalkingKiwi_Tracks5.csv')
+    parser.add_argument('--lists', type=int, default=None, help='inverted lists (default: sqrt of the trail count)')
+    parser.add_argument('--probe', type=int, default=N_PROBE, help='lists probed per query by default')
+    parser.add_argument('--pq', type=int, default=None, help='product quantize into this many sub-vectors')
+    parser.add_argument('--keep-vectors', action='store_true', help='with --pq, also keep float32 vectors to re-rank')
+    parser.add_argument('--rebuild', action='store_true', help='retrain instead of extending the previous index')
+    parser.add_argument('--report', action='store_true', help='print recall@k and latency instead of building')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--json', help='with --report, also write the report here')
+    args = parser.parse_args()
+    keep_vectors = True if args.keep_vectors else None
+    if args.report:
+        features = RecommendationIndex.from_frame(trail_store.load_frame(args.csv)).features
+        report = recall_report(features, k=args.k, queries=args.queries, probes=args.probes, n_lists=args.lists,
+                               pq_m=args.pq, keep_vectors=keep_vectors)
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=1)
+    else:
+        index = build_ann(args.csv, n_lists=args.lists, pq_m=args.pq, n_probe=args.probe,
+                          keep_vectors=keep_vectors, update=not args.rebuild)
+        print(f"{len(index):,} trails in {len(index.centroids)} lists ({index.meta['inserted_rows']:,} inserted since "
+              f"training), {index.nbytes:,} bytes")
@@ -0,0 +1,65 @@
+import numpy as np
+
+# points kept per trail for the elevation chart
+PROFILE_POINTS = 150
+# grade (%) at which a stretch of track counts as steep
+STEEP_GRADE = 15.0
+# -----------------------------------------------------
+# chart downsampling -- largest triangle three buckets keeps the peaks and dips a plain stride would miss
+def lttb(x, y, n_out):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    every = (n - 2) / (n_out - 2)
+    keep = np.empty(n_out, dtype=np.intp)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        # the point in this bucket making the largest triangle with the last kept point
+        # and the average of the next bucket
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+def downsample_profiles(values, offsets, length_km, n_out=PROFILE_POINTS):
+    # packed (distance km, elevation m) pairs per trail, row i lives in out[out_offsets[i]:out_offsets[i+1]]
+    parts = []
+    for i in range(len(offsets) - 1):
+        elev = np.asarray(values[offsets[i]:offsets[i+1]], dtype=np.float64)
+        # evenly spaced along the whole track, first sample at 0 and last at the track length
+        dist = np.linspace(0, float(length_km[i]), len(elev))
+        parts.append(np.column_stack(lttb(dist, elev, n_out)))
+    out_offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    out_offsets[1:] = np.cumsum([len(p) for p in parts])
+    out = np.concatenate(parts) if parts else np.empty((0, 2))
+    return out.astype(np.float32), out_offsets
+# -----------------------------------------------------
+# climb metrics for every trail at once, straight off the packed elevation array
+def climb_metrics(values, offsets, length_km, steep_grade=STEEP_GRADE):
+    n = len(offsets) - 1
+    counts = np.diff(offsets)
+    values = np.asarray(values, dtype=np.float64)
+    # trail id of every point, and the segments that stay within one trail
+    trail = np.repeat(np.arange(n), counts)
+    within = trail[1:] == trail[:-1]
+    seg_trail = trail[1:][within]
+    rise = np.diff(values)[within]
+    # samples are evenly spaced along the track
+    spacing = np.asarray(length_km, dtype=np.float64) * 1000 / np.maximum(counts - 1, 1)
+    run = spacing[seg_trail]
+    grade = np.divide(100 * rise, run, out=np.zeros_like(rise), where=run > 0)
+
+    ascent = np.bincount(seg_trail, weights=np.clip(rise, 0, None), minlength=n)
+    descent = np.bincount(seg_trail, weights=np.clip(-rise, 0, None), minlength=n)
+    max_grade = np.zeros(n)
+    np.maximum.at(max_grade, seg_trail, np.abs(grade))
+    # a steep section is a run of consecutive steep segments
+    steep = np.abs(grade) >= steep_grade
+    continues = np.r_[False, steep[:-1] & (seg_trail[1:] == seg_trail[:-1])]
+    steep_sections = np.bincount(seg_trail[steep & ~continues], minlength=n)
+    return {'cumAscent': ascent.astype(np.float32), 'cumDescent': descent.astype(np.float32),
+            'maxGrade': max_grade.astype(np.float32), 'steepSections': steep_sections.astype(np.float32)}
@@ -0,0 +1,65 @@
+import numpy as np
+
+# dropdown buckets offered by the app, as [low, high) ranges on the column they filter
+BUCKETS = {
+    'time_h': {'Short (< 1 hour)': (None, 1), 'Medium (1 - 5 hours)': (1, 5), 'Long (5+ hours)': (5, None)},
+    'length_km': {'Short (< 5 km)': (None, 5), 'Medium (5 - 10 km)': (5, 10), 'Long (10+ km)': (10, None)},
+    'totalAscent': {'Easy (< 100 m)': (None, 100), 'Moderate (100 - 600 m)': (100, 600), 'Challenging (600+ m)': (600, None)},
+}
+ALL_REGIONS = 'All Regions'
+# -----------------------------------------------------
+# precomputed bitsets for the parameter filter, built once per dataset version
+class FilterIndex:
+    def __init__(self, df, region_col='region', range_cols=tuple(BUCKETS)):
+        self.n = len(df)
+        self.all_bits = self._pack(np.ones(self.n, dtype=bool))
+        self.none_bits = np.zeros_like(self.all_bits)
+        # one bitset per region, a missing region matches none of them
+        present = df[region_col].notna().to_numpy()
+        regions = np.where(present, df[region_col].astype(object).to_numpy(), '')
+        self.regions = sorted(set(regions[present]))
+        self.region_bits = {region: self._pack(regions == region) for region in self.regions}
+        # rows sorted by value for each numeric column, missing values never match a range
+        self.sorted = {}
+        for col in range_cols:
+            values = df[col].to_numpy()
+            valid = np.flatnonzero(~np.isnan(values))
+            order = valid[np.argsort(values[valid], kind='stable')]
+            self.sorted[col] = (order, values[order])
+        # the dropdown buckets are just ranges we can answer ahead of time
+        self.bucket_bits = {col: {label: self.range_bits(col, lo, hi) for label, (lo, hi) in buckets.items()}
+                            for col, buckets in BUCKETS.items() if col in self.sorted}
+
+    def _pack(self, mask):
+        return np.packbits(mask)
+
+    def range_bits(self, col, lo=None, hi=None):
+        # rows with lo <= value < hi, either bound may be left open
+        order, values = self.sorted[col]
+        start = 0 if lo is None else np.searchsorted(values, lo, side='left')
+        stop = len(values) if hi is None else np.searchsorted(values, hi, side='left')
+        mask = np.zeros(self.n, dtype=bool)
+        mask[order[start:stop]] = True
+        return self._pack(mask)
+
+    def query(self, region=None, buckets=None, ranges=None):
+        """AND together the bitsets for a filter combination.
+
+        `buckets` maps a column to one of its dropdown labels (unknown labels such as
+        'All Lengths (km)' leave the column unfiltered) and `ranges` maps a column to
+        an arbitrary (low, high) pair. Returns a packed bitset over all rows.
+        """
+        bits = self.all_bits
+        if region is not None and region != ALL_REGIONS:
+            bits = bits & self.region_bits.get(region, self.none_bits)
+        for col, label in (buckets or {}).items():
+            bucket = self.bucket_bits[col].get(label)
+            if bucket is not None:
+                bits = bits & bucket
+        for col, (lo, hi) in (ranges or {}).items():
+            bits = bits & self.range_bits(col, lo, hi)
+        return bits
+
+    def mask(self, bits):
+        # packed bitset -> boolean row mask
+        return np.unpackbits(bits, count=self.n).view(bool)
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import trail_store
+from recommender_index import RecommendationIndex, FEATURE_COLS
+
+# how much scratch memory one block of the distance matrix may use
+MAX_BLOCK_BYTES = 64 << 20
+# -----------------------------------------------------
+# blocked all-pairs top-k, memory stays at block_rows x N no matter how large N gets
+def top_k_neighbours(features, k, block_rows=None, max_block_bytes=MAX_BLOCK_BYTES):
+    X = np.asarray(features, dtype=np.float64)
+    n = len(X)
+    k = min(k, n)
+    block_rows = block_rows or max(1, max_block_bytes // (8 * max(n, 1)))
+    sq_norms = (X ** 2).sum(axis=1)
+    ids = np.empty((n, k), dtype=np.int32)
+    dist = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, block_rows):
+        block = X[start:start+block_rows]
+        # squared distances from the block to every trail, ||a||^2 + ||b||^2 - 2ab
+        d2 = sq_norms[start:start+block_rows, None] + sq_norms[None, :] - 2 * block @ X.T
+        cand = np.argpartition(d2, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (len(block), 1))
+        # recompute the shortlist exactly so the ordering matches the live engine
+        cand_dist = np.sqrt(((X[cand] - block[:, None, :]) ** 2).sum(axis=2))
+        order = np.lexsort((cand, cand_dist), axis=-1)
+        ids[start:start+block_rows] = np.take_along_axis(cand, order, axis=1)
+        dist[start:start+block_rows] = np.take_along_axis(cand_dist, order, axis=1)
+    return ids, dist
+# -----------------------------------------------------
+# precomputed neighbours for every trail, stored alongside the compiled dataset
+class NeighbourTable:
+    def __init__(self, ids, dist, meta=None):
+        self.ids = ids
+        self.dist = dist
+        self.meta = meta or {}
+        self.k = ids.shape[1]
+
+    def query(self, row, k, mask=None):
+        """Closest k rows to `row` that pass `mask`, straight from the table.
+
+        Returns None when the filters knock out so many of the stored neighbours
+        that the table can no longer answer, the caller then falls back to a live search.
+        """
+        ids, dist = self.ids[row], self.dist[row]
+        n_allowed = len(self.ids)
+        if mask is not None:
+            keep = mask[ids]
+            ids, dist = ids[keep], dist[keep]
+            n_allowed = int(np.count_nonzero(mask))
+        if len(ids) < min(k, n_allowed):
+            return None
+        return ids[:k].astype(np.intp), dist[:k]
+
+    def query_batch(self, rows, k, mask=None):
+        # one gather for the whole batch, None for each query the table cannot answer
+        ids = np.asarray(self.ids[np.asarray(rows, dtype=np.intp)])
+        dist = np.asarray(self.dist[np.asarray(rows, dtype=np.intp)])
+        keep = np.ones(ids.shape, dtype=bool) if mask is None else mask[ids]
+        n_allowed = len(self.ids) if mask is None else int(np.count_nonzero(mask))
+        results = []
+        for row_ids, row_dist, row_keep in zip(ids, dist, keep):
+            row_ids, row_dist = row_ids[row_keep], row_dist[row_keep]
+            results.append(None if len(row_ids) < min(k, n_allowed) else (row_ids[:k].astype(np.intp), row_dist[:k]))
+        return results
+
+    def save(self, path):
+        for name, array in [('ids', self.ids), ('dist', self.dist)]:
+            tmp = os.path.join(path, f".neighbours.{name}.npy")
+            np.save(tmp, array)
+            os.replace(tmp, os.path.join(path, f"neighbours.{name}.npy"))
+        with open(os.path.join(path, 'neighbours.json'), 'w') as f:
+            json.dump(self.meta, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        # None if the batch job has not been run for this dataset version yet
+        if not os.path.exists(os.path.join(path, 'neighbours.json')):
+            return None
+        with open(os.path.join(path, 'neighbours.json')) as f:
+            meta = json.load(f)
+        ids = np.load(os.path.join(path, 'neighbours.ids.npy'), mmap_mode='r')
+        dist = np.load(os.path.join(path, 'neighbours.dist.npy'), mmap_mode='r')
+        return cls(ids, dist, meta)
+
+def build_table(csv_path, k=100, block_rows=None):
+    path = trail_store.resolve_store(csv_path)
+    df = trail_store.load_frame(csv_path)
+    features = RecommendationIndex.from_frame(df).features
+    start = time.perf_counter()
+    ids, dist = top_k_neighbours(features, k + 1, block_rows=block_rows)
+    meta = {'k': int(ids.shape[1]), 'rows': len(df), 'features': FEATURE_COLS,
+            'source_version': trail_store.open_store(path).version,
+            'build_seconds': round(time.perf_counter() - start, 3)}
+    table = NeighbourTable(ids, dist, meta)
+    table.save(path)
+    return table
+
+def load_table(csv_path):
+    return NeighbourTable.load(trail_store.resolve_store(csv_path))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the top-k similar trails for every trail.')
+    parser.add_argument('csv', help='track csv the app loads, e.g. data/WalkingKiwi_Tracks5.csv')
+    parser.add_argument('--k', type=int, default=100, help='neighbours to keep per trail, excluding itself')
+    parser.add_argument('--block-rows', type=int, default=None, help='rows per distance block (default: fit 64MB)')
+    args = parser.parse_args()
+    table = build_table(args.csv, k=args.k, block_rows=args.block_rows)
+    print(f"{table.meta['rows']} trails x {table.meta['k']} neighbours in {table.meta['build_seconds']}s "
+          f"({table.ids.nbytes + table.dist.nbytes:,} bytes)")
@@ -8,101 +8,83 @@ from path import Path
 import base64
 import pydeck as pdk
 import altair as alt
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics.pairwise import euclidean_distances
 import copy
+import trail_store
+from recommender_core import Recommender, DATA_PATH
+from trail_geometry import viewport_bounds
+import trail_metrics
+from trail_metrics import METRICS
 
-st.set_page_config(layout="wide")
 # -----------------------------------------------------
 # Load Dataset
+# served from the memory-mapped compiled store, only re-read when the csv changes
 def load_data(data):
-    df = pd.read_csv(data, index_col=0)
+    df = trail_store.load_frame(data)
     return df
-# Modify Dataset
-def param_filter(df, region_opt, time_opt, length_opt, ascent_opt):
-    filtered_df = df.copy(deep=True)
-    
-    if region_opt != 'All Regions': 
-        filtered_df = filtered_df[filtered_df['region'] == region_opt]
-    
-    if time_opt == 'Short (< 1 hour)': 
-        filtered_df = filtered_df[filtered_df['time_h'] < 1]
-    elif time_opt == 'Medium (1 - 5 hours)': 
-        filtered_df = filtered_df[(filtered_df['time_h'] >= 1) & (filtered_df['time_h'] < 5)]
-    elif time_opt == 'Long (5+ hours)':
-        filtered_df = filtered_df[filtered_df['time_h'] >= 5]
-    
-    if length_opt == 'Short (< 5 km)': 
-        filtered_df = filtered_df[filtered_df['length_km'] < 5]
-    elif length_opt == 'Medium (5 - 10 km)': 
-        filtered_df = filtered_df[(filtered_df['length_km'] >= 5) & (df['length_km'] < 10)]
-    elif length_opt == 'Long (10+ km)':
-        filtered_df = filtered_df[filtered_df['length_km'] >= 10]
-    
-    if ascent_opt == 'Easy (< 100 m)': 
-        filtered_df = filtered_df[filtered_df['totalAscent'] < 100]
-    elif ascent_opt == 'Moderate (100 - 600 m)': 
-        filtered_df = filtered_df[(filtered_df['totalAscent'] >= 100) & (df['totalAscent'] < 600)]
-    elif ascent_opt == 'Challenging (600+ m)':
-        filtered_df = filtered_df[filtered_df['totalAscent'] >= 600]
-    
-    return filtered_df
+# every index behind the recommendations and search, only rebuilt when the dataset version changes
+@st.cache(allow_output_mutation=True)
+def load_recommender(data, version):
+    return Recommender(data)
 # -----------------------------------------------------
+# track lines for the trails a map view shows, simplified for its zoom
+def trail_lines(recommender, view, mask=None, rows=None, limit=None, color=(255, 0, 0)):
+    bounds = viewport_bounds(view.latitude, view.longitude, view.zoom)
+    visible, paths = recommender.viewport(bounds, view.zoom, mask=mask, limit=limit, rows=rows)
+    # ~1 m precision is plenty on screen, and keeps float32 noise out of the JSON
+    lines = pd.DataFrame({'name': recommender.df['name'].to_numpy()[visible],
+                          'path': [np.round(path.astype(np.float64), 5).tolist() for path in paths]})
+    return pdk.Layer('PathLayer', lines, get_path='path', get_color=list(color), width_min_pixels=2,
+                     auto_highlight=True, pickable=True)
+
 # geographical map of hiking trails loaded
-def main_map(filtered_df):
-    st.pydeck_chart(pdk.Deck(
-        layers=[pdk.Layer('ScatterplotLayer', filtered_df, get_position=['lon', 'lat'],
+def main_map(recommender, allowed):
+    filtered_df = recommender.df.loc[allowed, ['name','lon','lat']]
+    view = pdk.ViewState(longitude=np.average(filtered_df['lon']), latitude=np.average(filtered_df['lat']),
+                         zoom=6, min_zoom=4, max_zoom=10, pitch=40.5, bearing=0)
+    deck = pdk.Deck(
+        # the tracks big enough to see where the map opens, every trailhead as a marker
+        layers=[trail_lines(recommender, view, mask=allowed, limit=MAIN_MAP_TRACKS),
+                pdk.Layer('ScatterplotLayer', filtered_df, get_position=['lon', 'lat'],
                           auto_highlight=True, get_radius=1250, # Radius is given in meters
                           get_fill_color=[255, 0, 0, 1000], pickable=True)], 
-        initial_view_state=pdk.ViewState(longitude=np.average(filtered_df['lon']), latitude=np.average(filtered_df['lat']),
-                                         zoom=6, min_zoom=4, max_zoom=10, pitch=40.5, bearing=0),
+        initial_view_state=view,
         map_style='mapbox://styles/mapbox/outdoors-v11', 
-        tooltip={'html': '{name}', 'style': {'color': 'white'}}))
-# -----------------------------------------------------
-# find closest euclidean distance as recommendation engine
-def euclidean_rec(title, df, filtered_df, num_of_rec):
-    # change route type into dummy values
-    trail_recomm = df[['name','time_h','length_km','netElevation','totalAscent']]
-    X = trail_recomm.drop(columns='name').values
-    # Standardize the features so that no feature dominates the distance computations due to unit scale
-    scaler = StandardScaler().fit(X)
-    X = scaler.transform(X)
-    # the hike you searched for
-    hike_lookup = trail_recomm.loc[trail_recomm['name'] == title]
-    hike_lookup = hike_lookup.drop(columns='name').values
-    hike_lookup = scaler.transform(hike_lookup)
-    # Distance from all other hikes
-    distances = euclidean_distances(X, hike_lookup)
-    distances = distances.reshape(-1)
-    # Find the indices with the minimum distance (highest similarity) to the hike we're looking at
-    ordered_indices = distances.argsort()
-    closest_indices = ordered_indices[:2500] 
-    # Get the hikes for these indices abnd relate back to original df or filtered df if appropriate
-    closest_trails = trail_recomm.iloc[closest_indices]
-    hike_names = closest_trails['name'].tolist()
-    # go back to df wqith parameter filtering
-    result_df = filtered_df[filtered_df['name'].isin(hike_names)][['name','region','type','time_h','length_km','totalAscent','trackElevation','lat','lon','coordinates']]
-    result_df = result_df.iloc[pd.Categorical(result_df['name'], categories=hike_names, ordered=True).argsort()]
-
-    return result_df[:num_of_rec+1]
+        tooltip={'html': '{name}', 'style': {'color': 'white'}})
+    METRICS.payload('pydeck_main_map', deck)
+    st.pydeck_chart(deck)
 # -----------------------------------------------------
-# function for searching for hikes without trail name
-def search_term_if_not_found(term, df):
-    result_df = df[df['name'].str.contains(term)]
-    return result_df[['name','region','type','time_h','length_km','totalAscent','trackElevation','lat','lon','coordinates']]
+def hike_summary(hike_row, df):
+    row = df.iloc[hike_row]
+    rec_time = row['time_h']
+    rec_hour, rec_min = str(rec_time).split('.')
+    rec_min = int(int(rec_min)*.60)
+    st.subheader(f"Trails Relating to **{row['name']}**")
+    st.text(f"Region: {row['region']} \t Time: {rec_hour}h, {rec_min}min \t Total Elevation: {row['totalAscent']}")
 # -----------------------------------------------------
-def hike_summary(search_term, df):
-    for row in df[df['name'] == search_term].iterrows():
-        rec_time = row[1][2]
-        rec_hour, rec_min = str(rec_time).split('.')
-        rec_min = int(int(rec_min)*.60)
-        st.subheader(f"Trails Relating to **{row[1][0]}**")
-        st.text(f"Region: {row[1][13]} \t Time: {rec_hour}h, {rec_min}min \t Total Elevation: {row[1][7]}")
+# chart and map specs for a result card, cached by trail row id and dataset version
+@st.cache(allow_output_mutation=True)
+def trail_chart(data, version, hike_row):
+    # downsampled (distance, elevation) profile precomputed when the dataset was compiled
+    profile = load_data(data)['elevationProfile'].iloc[hike_row]
+    source = pd.DataFrame({'Distance (km)': profile[:,0], 'Elevation (m)': profile[:,1]})
+    return alt.Chart(source).mark_line().encode(x='Distance (km)', y='Elevation (m)', tooltip=['Distance (km)','Elevation (m)'])
+
+@st.cache(allow_output_mutation=True)
+def trail_map(data, version, hike_row, result_rows):
+    recommender = load_recommender(data, version)
+    hike = recommender.df.iloc[hike_row]
+    points = recommender.df.iloc[list(result_rows)][['name','lon','lat']]
+    view = pdk.ViewState(latitude=float(hike['lat']), longitude=float(hike['lon']), zoom=12, bearing=0, pitch=45)
+    # the result tracks within view, and their trailheads
+    return pdk.Deck(layers=[trail_lines(recommender, view, rows=list(result_rows), color=(255, 200, 0)),
+                            pdk.Layer('ScatterplotLayer', points, get_position=['lon', 'lat'], get_radius=50, # Radius is given in meters
+                          get_fill_color=[255, 0, 0, 1000])],
+                    initial_view_state=view,
+                    map_style='mapbox://styles/mapbox/satellite-streets-v11')
 # -----------------------------------------------------
-def output_results(result_df):
-    for row in result_df.iterrows():
+def output_results(result_df, df, data, version):
+    result_rows = tuple(df.index.get_indexer(result_df.index).tolist())
+    for hike_row, row in zip(result_rows, result_df.iterrows()):
         with st.beta_expander(row[1][0]):
             col1, col2 = st.beta_columns([1,2])
             with col1:
@@ -114,24 +96,27 @@ def output_results(result_df):
                 rec_min = int(int(rec_min)*.60)
                 rec_length = row[1][4]
                 rec_ascent = row[1][5]
-                rec_elev = row[1][6]
-                rec_elev = str(rec_elev).split(',')
-                rec_elev = [float(i) for i in rec_elev]
-                rec_lat = row[1][7]
-                rec_lon  = row[1][8]
-                rec_coord = row[1][9]
-                stc.html(RESULT_TEMP.format(rec_title,rec_region,rec_type,rec_hour,rec_min,rec_length,rec_ascent), height=250)
-            with col2:
-                source = pd.DataFrame({'Elevation (m)': rec_elev, 'Distance (km)': np.arange(start=0, stop=float(rec_length), step=rec_length/len(rec_elev))})
-                c  = alt.Chart(source).mark_line().encode(x='Distance (km)', y='Elevation (m)', tooltip=['Distance (km)','Elevation (m)'])
-                st.altair_chart(c, use_container_width=True)
-            
-            st.pydeck_chart(pdk.Deck(layers=[pdk.Layer('ScatterplotLayer', result_df, get_position=['lon', 'lat'], get_radius=50, # Radius is given in meters
-                          get_fill_color=[255, 0, 0, 1000])],
-                                     initial_view_state=pdk.ViewState(latitude=rec_lat, longitude=rec_lon, zoom=12, bearing=0, pitch=45),
-                                     map_style='mapbox://styles/mapbox/satellite-streets-v11'))
+                # DOC status and difficulty, linked in when the dataset was compiled
+                rec_status = DOC_STATUS.get(row[1][10], 'Unknown, check the DOC website')
+                rec_difficulty = row[1][11] or 'Not graded by DOC'
+                stc.html(RESULT_TEMP.format(rec_title,rec_region,rec_type,rec_hour,rec_min,rec_length,rec_ascent,rec_status,rec_difficulty), height=300)
+                # the chart and map are only built once someone opens them up
+                show_details = st.checkbox('Show elevation profile and map', key=f"details-{hike_row}")
+            if show_details:
+                with METRICS.span('trail_chart'):
+                    chart = trail_chart(data, version, hike_row)
+                    METRICS.payload('altair_trail_chart', chart)
+                with col2:
+                    st.altair_chart(chart, use_container_width=True)
+                with METRICS.span('trail_map'):
+                    deck = trail_map(data, version, hike_row, result_rows)
+                    METRICS.payload('pydeck_trail_map', deck)
+                st.pydeck_chart(deck)
             
 # ------------------ Page Set-Up ------------------
+DOC_STATUS = {'OPEN': 'Open', 'CLSD': 'Closed'}
+# most track lines the overview map carries, the largest on screen win
+MAIN_MAP_TRACKS = 2000
 # CSS Style for ~Aesthetics~
 RESULT_TEMP = """
 <p style = "color:black;margin-bottom: -10px;"><b>{}</b></p>
@@ -140,6 +125,8 @@ RESULT_TEMP = """
 <p style = "color:black;margin-bottom: -10px;"><span style="color:red;">Time: </span>{}<span> hr, </span>{}<span> min</span></p>
 <p style = "color:black;margin-bottom: -10px;"><span style="color:red;">Length: </span>{}<span> km</span></p>
 <p style = "color:black;margin-bottom: -10px;"><span style="color:red;">Total Ascent: </span>{}<span> m</span></p>
+<p style = "color:black;margin-bottom: -10px;"><span style="color:red;">DOC Status: </span>{}</p>
+<p style = "color:black;margin-bottom: -10px;"><span style="color:red;">DOC Difficulty: </span>{}</p>
 """
 
 def img_to_bytes(img_path):
@@ -147,23 +134,35 @@ def img_to_bytes(img_path):
     encoded = base64.b64encode(img_bytes).decode()
     return encoded
 
-header_html = "<img src='data:image/png;base64,{}' class='img-fluid'>".format(img_to_bytes("images/Recommender_Header_wide.png"))
-st.markdown(header_html, unsafe_allow_html=True,)
+def page_setup():
+    st.set_page_config(layout="wide")
+    header_html = "<img src='data:image/png;base64,{}' class='img-fluid'>".format(img_to_bytes("images/Recommender_Header_wide.png"))
+    st.markdown(header_html, unsafe_allow_html=True,)
 
-menu = ['Recommend','Data Overview']
-choice = st.sidebar.radio("Directory", menu)
-st.sidebar.write("Welcome to the hiking trail recommender system for New Zealand.\n\n Recommender systems are among the most popular applications of data science today. They help to overcome the problem of being inundated with choices. With this recommendation system you can parse through trailheads to find appropriate hikes that suite your needs and help you get out and enjoy the beauty of New Zealand.\n\nSome of the hiking trail information was assembled from the [Department of Conservation (DOC)](https://www.doc.govt.nz) and used under the [Creative Commons 3.0 license](https://creativecommons.org/licenses/by/3.0/nz/) in combination with track data obtained from other sources.\n\n Data was acquired May 2021 and may not accurately reflect current trail information. If you intend to walk a track, please confirm with your local office or the DOC website that the track isn't under a temporary or more permanent closure before embarking.")
+    menu = ['Recommend','Data Overview']
+    choice = st.sidebar.radio("Directory", menu)
+    st.sidebar.write("Welcome to the hiking trail recommender system for New Zealand.\n\n Recommender systems are among the most popular applications of data science today. They help to overcome the problem of being inundated with choices. With this recommendation system you can parse through trailheads to find appropriate hikes that suite your needs and help you get out and enjoy the beauty of New Zealand.\n\nSome of the hiking trail information was assembled from the [Department of Conservation (DOC)](https://www.doc.govt.nz) and used under the [Creative Commons 3.0 license](https://creativecommons.org/licenses/by/3.0/nz/) in combination with track data obtained from other sources.\n\n Data was acquired May 2021 and may not accurately reflect current trail information. If you intend to walk a track, please confirm with your local office or the DOC website that the track isn't under a temporary or more permanent closure before embarking.")
+    return choice
 # ------------------ Page Set-Up ------------------
 
 def main():   
-    df = load_data("data/WalkingKiwi_Tracks5.csv")
+    choice = page_setup()
+    with METRICS.span('load_data'):
+        version = trail_store.data_version(DATA_PATH)
+        recommender = load_recommender(DATA_PATH, version)
+        df = recommender.df
     if choice == "Recommend":
         st.subheader("Hike Search Engine")
         search_term = st.text_input('Search by Trail Name')
+        if search_term and recommender.lookup(search_term) is None:
+            # completions of a partly typed name, so the exact trail is one copy away
+            completions = recommender.autocomplete(search_term, 5)
+            if len(completions):
+                st.caption('Did you mean: ' + ' · '.join(df['name'].iloc[completions]))
         left, right = st.beta_columns(2)
         with left:
             # extra search parameters -- filter dataset based on given parameters
-            regions = sorted(df.region.unique())
+            regions = list(recommender.filter_index.regions)
             regions.insert(0,'All Regions')
             region_opt = st.selectbox('Search by Region', regions)
             times = ['All Lengths (h)','Short (< 1 hour)','Medium (1 - 5 hours)','Long (5+ hours)']
@@ -172,25 +171,66 @@ def main():
             length_opt = st.selectbox('Search by Length', lengths)            
             grade = ['All Elevations (m)','Easy (< 100 m)','Moderate (100 - 600 m)','Challenging (600+ m)']
             ascent_opt = st.selectbox('Search by Total Elevation', grade)            
+            distances = {'Any Distance': None, 'Within 10 km': 10, 'Within 25 km': 25, 'Within 50 km': 50, 'Within 100 km': 100}
+            radius_opt = st.selectbox('Distance from Searched Trail', list(distances))
+            engines = {'Trail Statistics': 'statistics', 'Trail Descriptions': 'descriptions', 'Statistics and Descriptions': 'hybrid'}
+            engine_opt = st.selectbox('Recommend Similar', list(engines))
+            # travel distance can only be blended into the trail statistics ranking
+            ranks = ['Similarity','Similarity and Distance'] if engines[engine_opt] == 'statistics' else ['Similarity']
+            rank_opt = st.selectbox('Rank Recommendations by', ranks)
             num_rec = st.number_input("Number of Hikes to Recommend",3,25,5)
-            filtered_df = param_filter(df, region_opt, time_opt, length_opt, ascent_opt)            
+            with METRICS.span('param_filter'):
+                allowed = recommender.param_filter(region_opt, time_opt, length_opt, ascent_opt)            
         with right:
             st.write(" ")
             st.write(' ')
-            main_map(filtered_df)
+            with METRICS.span('main_map'):
+                main_map(recommender, allowed)
+
+        # everything that decides the recommendations; saved results are only shown while these are unchanged
+        inputs = (version, search_term, region_opt, time_opt, length_opt, ascent_opt, radius_opt,
+                  engine_opt, rank_opt, num_rec)
+        if st.button("Recommend"):
+            with METRICS.span('lookup'):
+                hike_row = recommender.lookup(search_term)
+            result_rows = None
+            warning = None
+            if hike_row is not None:
+                try:
+                    with METRICS.span('euclidean_rec' if engines[engine_opt] == 'statistics' else 'text_rec'):
+                        # the searched hike itself is never among its recommendations
+                        result_rows, _ = recommender.recommend(hike_row, num_rec, mask=allowed, engine=engines[engine_opt],
+                                                               radius_km=distances[radius_opt],
+                                                               geo_weight=1 if rank_opt == 'Similarity and Distance' else 0)
+                except Exception as err:
+                    # still show name matches, but never silently -- counted and reported
+                    METRICS.inc('trail_search_path_total', path='fallback', reason=type(err).__name__)
+                    warning = f"Could not recommend trails for **{search_term}** ({type(err).__name__}: {err})."
+                else:
+                    METRICS.inc('trail_search_path_total', path='exact')
+            else:
+                METRICS.inc('trail_search_path_total', path='fallback', reason='no_match')
+            search_rows = None
+            if result_rows is None:
+                with METRICS.span('search'):
+                    search_rows = recommender.search(search_term, num_rec, mask=allowed)
+            # kept across reruns, ticking a result's details checkbox reruns the script without the button
+            st.session_state['last_recommend'] = {'inputs': inputs, 'hike_row': hike_row, 'result_rows': result_rows,
+                                                  'search_rows': search_rows, 'warning': warning}
 
-        if st.button("Recommend"):            
-            try:
-                result_df = euclidean_rec(search_term, df, filtered_df, num_of_rec=num_rec)
-                hike_summary(search_term, df)
-                if result_df['name'].str.contains(search_term).any(): 
-                    output_results(result_df[1:])
-                else: 
-                    output_results(result_df[:num_rec])
-            except:
+        last = st.session_state.get('last_recommend')
+        if last is not None and last['inputs'] == inputs:
+            if last['warning']:
+                st.warning(last['warning'])
+            if last['result_rows'] is not None:
+                with METRICS.span('hike_summary'):
+                    hike_summary(last['hike_row'], df)
+                with METRICS.span('output_results'):
+                    output_results(recommender.frame(last['result_rows']), df, DATA_PATH, version)
+            else:
                 st.info("Suggested Hiking Trail Names:")
-                results_df = search_term_if_not_found(search_term, filtered_df)[:num_rec]
-                output_results(results_df)
+                with METRICS.span('output_results'):
+                    output_results(recommender.frame(last['search_rows']), df, DATA_PATH, version)
 
     elif choice == "Data Overview":
         st.subheader("Data Overview")
@@ -199,4 +239,10 @@ def main():
 
 # -----------------------------------------------------    
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # exports and profiling are switched on with TRAIL_METRICS_FILE / TRAIL_METRICS_PORT / TRAIL_PROFILE_DIR
+    metrics_config = trail_metrics.configure()
+    try:
+        with trail_metrics.profiled(metrics_config['profile_dir']), METRICS.rerun():
+            main()
+    finally:
+        trail_metrics.export(metrics_config)
\ No newline at end of file
@@ -0,0 +1,327 @@
+import json
+import threading
+import numpy as np
+import trail_store
+from recommender_index import RecommendationIndex
+from filter_index import FilterIndex, ALL_REGIONS
+from trail_search import TrailSearchIndex
+from neighbour_table import load_table
+from ann_index import load_ann
+from spatial_index import SpatialIndex, blended_query
+from text_index import TextIndex, hybrid_query
+from trail_geometry import GeometryStore, encode_polyline, viewport_bounds
+
+DATA_PATH = "data/WalkingKiwi_Tracks5.csv"
+# columns a recommendation carries through to the result cards
+RESULT_COLS = ['name','region','type','time_h','length_km','totalAscent','elevationProfile','lat','lon','coordinates','docStatus','docDifficulty']
+# the flat part of a result, what goes out over JSON -- geometry and profiles stay server side
+SUMMARY_COLS = ['name','region','type','time_h','length_km','totalAscent','lat','lon','docStatus','docDifficulty']
+# how much of the score the descriptions carry for each engine, None ranks on trail statistics alone
+ENGINES = {'statistics': None, 'descriptions': 1.0, 'hybrid': 0.5}
+# -----------------------------------------------------
+# every index the recommender needs for one dataset version
+class Recommender:
+    """Recommendations and name search over one version of the dataset.
+
+    Nothing is modified after construction (the text index is built once, under a
+    lock, the first time it is needed), so a single instance can be shared by any
+    number of threads.
+    """
+    def __init__(self, data=DATA_PATH):
+        self.data = data
+        self.version = trail_store.data_version(data)
+        self.df = trail_store.load_frame(data)
+        self.rec_index = RecommendationIndex.from_frame(self.df, version=self.version)
+        self.filter_index = FilterIndex(self.df)
+        self.search_index = TrailSearchIndex(self.df['name'])
+        # precomputed top-k table from neighbour_table.py, None until the batch job has been run
+        self.neighbour_table = load_table(data)
+        # IVF index from ann_index.py, None unless built -- only worth it where its report beats the kd-tree
+        self.ann_index = load_ann(data)
+        # what the statistics engine searches live when the table cannot answer
+        self.live_index = self.ann_index if self.ann_index is not None else self.rec_index
+        self.spatial_index = SpatialIndex.from_frame(self.df)
+        # track lines per zoom level and the viewport grid, None for a catalog without track coordinates
+        store = trail_store.open_store(trail_store.resolve_store(data))
+        self.geometry = GeometryStore.open(store.path, store.manifest)
+        self._text_index = None
+        self._text_lock = threading.Lock()
+        self._summary = None
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def text_index(self):
+        # tf-idf over names, types, regions and DOC introductions, built on the first description query
+        if self._text_index is None:
+            with self._text_lock:
+                if self._text_index is None:
+                    self._text_index = TextIndex.from_frame(self.df)
+        return self._text_index
+
+    # Modify Dataset -- boolean mask of the trails matching the selected parameters
+    def param_filter(self, region=None, time=None, length=None, ascent=None, ranges=None):
+        bits = self.filter_index.query(region=region,
+                                       buckets={'time_h': time, 'length_km': length, 'totalAscent': ascent},
+                                       ranges=ranges)
+        return self.filter_index.mask(bits)
+
+    def lookup(self, name):
+        # names are matched ignoring case, macrons, punctuation and Tk/Track
+        return self.search_index.lookup(name)
+
+    def search(self, term, k, mask=None):
+        """Row ids of up to k trails whose names best match `term`."""
+        return np.asarray(self.search_index.search(term, limit=k, mask=mask), dtype=np.intp)
+
+    def autocomplete(self, prefix, k, mask=None):
+        # row ids of up to k trails with a word starting with `prefix`, names starting with it first
+        return np.asarray(self.search_index.autocomplete(prefix, limit=k, mask=mask), dtype=np.intp)
+
+    def recommend(self, row, k, mask=None, engine='statistics', radius_km=None, geo_weight=0):
+        """Row ids and scores of the k trails most like trail `row`, never including `row` itself.
+
+        `engine` is one of ENGINES. With radius_km only trails that close to `row` are
+        considered, and geo_weight > 0 ranks results by travel distance too, which only
+        the 'statistics' engine supports. Lower scores are closer, except for the
+        'descriptions' engine where they are cosine similarities.
+        """
+        text_weight = ENGINES[engine]
+        if geo_weight and text_weight is not None:
+            # description scores are not distances, there is nothing to add travel km to
+            raise ValueError(f"geo_weight only applies to the 'statistics' engine, not {engine!r}")
+        allowed = mask
+        if radius_km is not None and not geo_weight:
+            # "similar hikes within X km" -- the radius is one more filter on the trails searched
+            within = self.spatial_index.within_mask(row, radius_km)
+            allowed = within if mask is None else mask & within
+        # one extra so there is still k left once the hike itself is dropped
+        if text_weight is None:
+            if geo_weight:
+                # blend in how far away each trail is from the hike we're looking at
+                closest = blended_query(row, k+1, self.rec_index, self.spatial_index, mask=mask,
+                                        radius_km=radius_km, geo_weight=geo_weight)
+            else:
+                # straight from the precomputed table unless the filters removed too many of its neighbours
+                closest = self.neighbour_table.query(row, k+1, mask=allowed) if self.neighbour_table is not None else None
+                if closest is None:
+                    closest = self.live_index.query(row, k+1, mask=allowed)
+        elif text_weight < 1:
+            closest = hybrid_query(row, k+1, self.rec_index, self.text_index, mask=allowed, text_weight=text_weight)
+        else:
+            closest = self.text_index.query(row, k+1, mask=allowed)
+        return _drop_row(row, *closest, k)
+
+    def nearby(self, lat, lon, k, mask=None, radius_km=None):
+        # row ids and distances in km of the k trailheads closest to a point, "near me", within radius_km if given
+        if radius_km is not None:
+            ids, km = self.spatial_index.within(lat, lon, radius_km, mask=mask)
+            return ids[:k], km[:k]
+        return self.spatial_index.nearest(lat, lon, k, mask=mask)
+
+    def recommend_batch(self, rows, k, mask=None, engine='statistics'):
+        """recommend() for many trails sharing one filter mask, in a single pass over the index.
+
+        Only the radius-free, unblended engines batch; anything else goes through
+        recommend() one trail at a time.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        text_weight = ENGINES[engine]
+        if text_weight == 1.0:
+            closest = self.text_index.query_batch(rows, k+1, mask=mask)
+        elif text_weight is None:
+            closest = self.neighbour_table.query_batch(rows, k+1, mask=mask) if self.neighbour_table is not None else [None] * len(rows)
+            missing = [i for i, c in enumerate(closest) if c is None]
+            if missing:
+                for i, c in zip(missing, self.live_index.query_batch(rows[missing], k+1, mask=mask)):
+                    closest[i] = c
+        else:
+            return [self.recommend(row, k, mask=mask, engine=engine) for row in rows]
+        return [_drop_row(row, ids, scores, k) for row, (ids, scores) in zip(rows, closest)]
+
+    def viewport(self, bounds, zoom, mask=None, limit=None, rows=None):
+        """Row ids and (lon, lat) track lines of the trails a map shows.
+
+        `bounds` is (west, south, east, north) and the lines come simplified for
+        `zoom`. With `rows` only those trails are considered.
+        """
+        if self.geometry is None:
+            return np.empty(0, dtype=np.intp), []
+        if rows is not None:
+            only = np.zeros(len(self), dtype=bool)
+            only[rows] = True
+            mask = only if mask is None else mask & only
+        visible = self.geometry.visible(bounds, zoom, mask=mask, limit=limit)
+        return visible, self.geometry.paths(visible, zoom)
+
+    def frame(self, rows):
+        # result rows as the dataframe the result cards are drawn from
+        return self.df.iloc[rows][RESULT_COLS]
+
+    def records(self, rows, scores=None):
+        # result rows as plain JSON-ready dicts, missing values as None
+        if self._summary is None:
+            # plain column arrays, so a batch of results costs no per-query pandas indexing
+            self._summary = {col: self.df[col].to_numpy() for col in SUMMARY_COLS}
+        records = []
+        for i, row in enumerate(rows):
+            record = {col: _json_value(values[row]) for col, values in self._summary.items()}
+            record['row'] = int(row)
+            if scores is not None:
+                record['score'] = round(float(scores[i]), 6)
+            records.append(record)
+        return records
+
+def _json_value(value):
+    if isinstance(value, np.floating):
+        # the store keeps float32, going through the shortest repr stops 3.61 going out as 3.609999895
+        return None if np.isnan(value) else float(str(value))
+    return value
+
+def _drop_row(row, ids, scores, k):
+    keep = ids != row
+    return ids[keep][:k], scores[keep][:k]
+# -----------------------------------------------------
+# batched requests -- the same filters are only computed once, and queries sharing them are answered together
+def _filter_key(query):
+    return json.dumps([query.get('region') or ALL_REGIONS, query.get('time'), query.get('length'),
+                       query.get('ascent'), query.get('ranges')], sort_keys=True)
+
+def _check(query, default_k=None):
+    # a query has to be a JSON object, and asking for fewer than one result is a mistake, not an empty answer
+    if not isinstance(query, dict):
+        raise ValueError(f"each query must be an object, got {query!r}")
+    if default_k is None:
+        return None
+    k = int(query.get('k', default_k))
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+    return k
+
+def _mask(recommender, query, masks):
+    key = _filter_key(query)
+    if key not in masks:
+        masks[key] = recommender.param_filter(query.get('region'), query.get('time'), query.get('length'),
+                                              query.get('ascent'), query.get('ranges'))
+    return masks[key], key
+
+def recommend_many(recommender, queries):
+    """Answer a batch of recommendation queries.
+
+    Each query is a dict with the trail's `name` (or its `row`), `k` (default 5),
+    the filter fields `region`, `time`, `length`, `ascent` and `ranges`, and
+    optionally `engine`, `radius_km` and `geo_weight`. Returns one result dict per
+    query, in order; a name that matches no trail gets name suggestions instead.
+    """
+    results = [None] * len(queries)
+    masks = {}
+    groups = {}
+    for i, query in enumerate(queries):
+        k = _check(query, default_k=5)
+        engine = query.get('engine', 'statistics')
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, expected one of {sorted(ENGINES)}")
+        mask, key = _mask(recommender, query, masks)
+        row = query['row'] if 'row' in query else recommender.lookup(query.get('name', ''))
+        if row is None:
+            results[i] = {'row': None, 'trails': [],
+                          'suggestions': recommender.records(recommender.search(query.get('name', ''), k, mask=mask))}
+        elif not 0 <= int(row) < len(recommender):
+            raise ValueError(f"row {row} out of range")
+        elif query.get('radius_km') is None and not query.get('geo_weight'):
+            groups.setdefault((key, k, engine), []).append((i, int(row)))
+        else:
+            ids, scores = recommender.recommend(int(row), k, mask=mask, engine=engine,
+                                                radius_km=query.get('radius_km'), geo_weight=query.get('geo_weight', 0))
+            results[i] = {'row': int(row), 'trails': recommender.records(ids, scores)}
+    for (key, k, engine), members in groups.items():
+        rows = [row for _, row in members]
+        for (i, row), (ids, scores) in zip(members, recommender.recommend_batch(rows, k, mask=masks[key], engine=engine)):
+            results[i] = {'row': row, 'trails': recommender.records(ids, scores)}
+    return results
+
+def nearby_many(recommender, queries):
+    """Trails closest to a batch of points.
+
+    Each query has the point's `lat` and `lon`, `k` (default 10), an optional
+    `radius_km` and the same filter fields as recommend_many. Each trail's
+    score is its distance from the point in km.
+    """
+    masks = {}
+    results = []
+    for query in queries:
+        k = _check(query, default_k=10)
+        lat, lon = float(query['lat']), float(query['lon'])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"no such point lat={lat}, lon={lon}")
+        radius_km = query.get('radius_km')
+        mask, _ = _mask(recommender, query, masks)
+        ids, km = recommender.nearby(lat, lon, k, mask=mask, radius_km=float(radius_km) if radius_km is not None else None)
+        results.append({'trails': recommender.records(ids, km)})
+    return results
+
+def viewport_many(recommender, queries):
+    """Track lines for a batch of map views.
+
+    Each query gives the view as `bbox` [west, south, east, north] or as its
+    centre `lat`, `lon` (with optional `width` and `height` in pixels), plus
+    `zoom`, an optional `limit` and the same filter fields as recommend_many.
+    Lines come as [lon, lat] lists, or as Google encoded polylines with
+    `encoding` 'polyline'.
+    """
+    masks = {}
+    results = []
+    names = recommender.df['name'].to_numpy()
+    for query in queries:
+        _check(query)
+        mask, _ = _mask(recommender, query, masks)
+        zoom = float(query['zoom'])
+        if 'bbox' in query:
+            bounds = tuple(float(v) for v in query['bbox'])
+            if len(bounds) != 4:
+                raise ValueError("bbox must be [west, south, east, north]")
+        else:
+            size = {k: int(query[k]) for k in ('width', 'height') if k in query}
+            bounds = viewport_bounds(float(query['lat']), float(query['lon']), zoom,
+                                     **{f"{k}_px": v for k, v in size.items()})
+        limit = query.get('limit')
+        rows, paths = recommender.viewport(bounds, zoom, mask=mask, limit=int(limit) if limit is not None else None)
+        if query.get('encoding', 'coordinates') == 'polyline':
+            lines = [encode_polyline(path) for path in paths]
+        else:
+            lines = [np.round(path.astype(np.float64), 5).tolist() for path in paths]
+        results.append({'bbox': list(bounds), 'trails': [{'row': int(row), 'name': names[row], 'path': line}
+                                                         for row, line in zip(rows, lines)]})
+    return results
+
+# how search_many matches the term: fuzzy name search, or prefix autocomplete for as-you-type suggestions
+SEARCH_MODES = ('fuzzy', 'prefix')
+
+def search_many(recommender, queries):
+    # each query is a dict with a search `term`, `k` (default 10), `mode` (one of SEARCH_MODES, default fuzzy)
+    # and the same filter fields as recommend_many
+    masks = {}
+    results = []
+    for query in queries:
+        k = _check(query, default_k=10)
+        mode = query.get('mode', 'fuzzy')
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"unknown search mode {mode!r}, expected one of {list(SEARCH_MODES)}")
+        mask, _ = _mask(recommender, query, masks)
+        find = recommender.search if mode == 'fuzzy' else recommender.autocomplete
+        rows = find(query.get('term', ''), k, mask=mask)
+        results.append({'trails': recommender.records(rows)})
+    return results
+# -----------------------------------------------------
+# one shared instance per data file, rebuilt only when the dataset version changes
+_recommenders = {}
+_recommenders_lock = threading.Lock()
+
+def get_recommender(data=DATA_PATH):
+    version = trail_store.data_version(data)
+    with _recommenders_lock:
+        recommender = _recommenders.get(data)
+        if recommender is None or recommender.version != version:
+            recommender = _recommenders[data] = Recommender(data)
+    return recommender
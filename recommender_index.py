@@ -0,0 +1,91 @@
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+from sklearn.neighbors import KDTree
+
+# features the euclidean recommender compares hikes on
+FEATURE_COLS = ['time_h','length_km','netElevation','totalAscent']
+# how much memory the neighbour lists of one block of batched queries may use
+MAX_BLOCK_BYTES = 64 << 20
+# -----------------------------------------------------
+# persistent nearest neighbour index, built once per dataset version
+class RecommendationIndex:
+    def __init__(self, features, version=None, leaf_size=40, brute_force_max=2048):
+        # standardized feature matrix, one row per trail (row id == position in the dataset)
+        self.features = np.ascontiguousarray(features, dtype=np.float32)
+        self.version = version
+        # below this many allowed trails a straight scan of the subset beats walking the tree
+        self.brute_force_max = brute_force_max
+        self.tree = KDTree(self.features, leaf_size=leaf_size)
+
+    @classmethod
+    def from_frame(cls, df, version=None, feature_cols=FEATURE_COLS, **kwargs):
+        # the derived climb metrics (cumAscent, maxGrade, steepSections) can be added to feature_cols
+        X = df[feature_cols].to_numpy(dtype=np.float64)
+        # Standardize the features so that no feature dominates the distance computations due to unit scale
+        X = StandardScaler().fit_transform(X)
+        return cls(X, version=version, **kwargs)
+
+    def __len__(self):
+        return len(self.features)
+
+    def query(self, row, k, mask=None):
+        """Return the row ids and distances of the k trails closest to `row`.
+
+        `mask` is an optional boolean array over all rows; only rows where it is
+        True are returned. Results are ordered by distance with ties broken by row id.
+        """
+        n = len(self)
+        n_allowed = n if mask is None else int(np.count_nonzero(mask))
+        k = min(k, n_allowed)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        target = self.features[row:row+1]
+
+        if mask is not None and n_allowed <= self.brute_force_max:
+            # filters left only a handful of trails, scan them directly
+            ids = np.flatnonzero(mask)
+            dist = np.sqrt(((self.features[ids] - target) ** 2).sum(axis=1))
+        else:
+            # widen the tree search until enough neighbours survive the filter mask,
+            # starting from the number we expect to need given how selective the mask is
+            fetch = min(n, max(k, int(np.ceil(k * n / n_allowed * 1.5))))
+            while True:
+                dist, ids = self.tree.query(target, k=fetch)
+                dist, ids = dist[0], ids[0]
+                if mask is not None:
+                    keep = mask[ids]
+                    dist, ids = dist[keep], ids[keep]
+                if len(ids) >= k or fetch == n:
+                    break
+                fetch = min(n, fetch * 2)
+
+        order = np.lexsort((ids, dist))[:k]
+        return ids[order], dist[order].astype(np.float32)
+
+    def query_batch(self, rows, k, mask=None, max_block_bytes=MAX_BLOCK_BYTES):
+        # many queries sharing one filter mask, answered with one tree query per block of rows
+        rows = np.asarray(rows, dtype=np.intp)
+        n = len(self)
+        n_allowed = n if mask is None else int(np.count_nonzero(mask))
+        k = min(k, n_allowed)
+        if k <= 0 or len(rows) == 0 or (mask is not None and n_allowed <= self.brute_force_max):
+            # a subset scan per row is cheaper than fetching most of the tree for every row
+            return [self.query(row, k, mask) for row in rows]
+        fetch = min(n, max(k, int(np.ceil(k * n / n_allowed * 1.5))))
+        # 16 bytes (distance and id) per fetched neighbour
+        block = max(1, max_block_bytes // (16 * fetch))
+        results = []
+        for start in range(0, len(rows), block):
+            block_rows = rows[start:start+block]
+            dist, ids = self.tree.query(self.features[block_rows], k=fetch)
+            for row, row_dist, row_ids in zip(block_rows, dist, ids):
+                if mask is not None:
+                    keep = mask[row_ids]
+                    row_dist, row_ids = row_dist[keep], row_ids[keep]
+                if len(row_ids) < k:
+                    # this one needs a wider search than the rest of the batch
+                    results.append(self.query(row, k, mask))
+                    continue
+                order = np.lexsort((row_ids, row_dist))[:k]
+                results.append((row_ids[order], row_dist[order].astype(np.float32)))
+        return results
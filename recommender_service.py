@@ -0,0 +1,161 @@
+import json
+import time
+import select
+import argparse
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from recommender_core import DATA_PATH, get_recommender, nearby_many, recommend_many, search_many, viewport_many
+from trail_metrics import METRICS, send_prometheus
+
+# most queries one request may carry
+MAX_BATCH = 1000
+# longest a client may take sending one request before its connection is dropped
+REQUEST_TIMEOUT = 30
+# longest an idle keep-alive connection holds on to its worker, checked every IDLE_POLL seconds
+KEEP_ALIVE_TIMEOUT = 5
+IDLE_POLL = 0.05
+# -----------------------------------------------------
+# local HTTP/JSON front end to recommender_core, for the mobile client and load tests
+#
+#   GET  /health     {"version": ..., "trails": ...}
+#   GET  /metrics    request timings in Prometheus text format
+#   POST /recommend  {"queries": [{"name": "Rob Roy Track", "k": 5, "region": "Otago", ...}, ...]}
+#   POST /search     {"queries": [{"term": "roy", "k": 10}, {"term": "rob r", "mode": "prefix"}, ...]}
+#   POST /nearby     {"queries": [{"lat": -44.69, "lon": 169.13, "k": 10, "radius_km": 25, "region": "Otago"}, ...]}
+#   POST /viewport   {"queries": [{"bbox": [168.5, -45.2, 169.5, -44.6], "zoom": 10, "encoding": "polyline"}, ...]}
+#
+# every POST endpoint answers {"version": ..., "results": [...]} with one result per query, in order
+class RecommenderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = REQUEST_TIMEOUT
+
+    def handle(self):
+        # keep-alive, but a connection only keeps its worker while no other connection is waiting for one
+        self.handle_one_request()
+        while not self.close_connection and self._next_request():
+            self.handle_one_request()
+
+    def _next_request(self):
+        # wait for the client's next request, False once the connection should be given up instead
+        self.connection.setblocking(False)
+        try:
+            # a pipelined request may already sit in the read buffer, where select cannot see it
+            if self.rfile.peek(1):
+                return True
+        finally:
+            self.connection.settimeout(self.timeout)
+        deadline = time.monotonic() + KEEP_ALIVE_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.server.closing or self.server.waiting():
+                return False
+            if select.select([self.connection], [], [], IDLE_POLL)[0]:
+                return True
+        return False
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        if not self.close_connection and (self.server.closing or self.server.waiting()):
+            # other clients are queued for a worker, this one reconnects for its next request
+            self.send_header('Connection', 'close')
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            return send_prometheus(self)
+        if self.path != '/health':
+            return self._send(404, {'error': f"no such endpoint {self.path}"})
+        recommender = get_recommender(self.server.data)
+        self._send(200, {'version': recommender.version, 'trails': len(recommender)})
+
+    def do_POST(self):
+        handlers = {'/recommend': recommend_many, '/search': search_many, '/nearby': nearby_many,
+                    '/viewport': viewport_many}
+        if self.path not in handlers:
+            return self._send(404, {'error': f"no such endpoint {self.path}"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            queries = body['queries']
+            if not isinstance(queries, list) or len(queries) > MAX_BATCH:
+                raise ValueError(f"queries must be a list of at most {MAX_BATCH} queries")
+            with METRICS.rerun('service' + self.path.replace('/', '_')):
+                # every worker shares the same read-only recommender
+                recommender = get_recommender(self.server.data)
+                results = handlers[self.path](recommender, queries)
+        except (ValueError, KeyError, TypeError) as err:
+            METRICS.inc('trail_service_errors_total', endpoint=self.path, reason=type(err).__name__)
+            return self._send(400, {'error': f"{type(err).__name__}: {err}"})
+        METRICS.inc('trail_service_queries_total', len(queries), endpoint=self.path)
+        self._send(200, {'version': recommender.version, 'results': results})
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+class RecommenderServer(HTTPServer):
+    """HTTP server handing each connection to a fixed pool of worker threads.
+
+    Idle keep-alive connections are closed as soon as another connection is
+    queued, after KEEP_ALIVE_TIMEOUT, or when the server closes.
+    """
+    def __init__(self, address, data=DATA_PATH, workers=8, quiet=False):
+        super().__init__(address, RecommenderHandler)
+        self.data = data
+        self.quiet = quiet
+        self.pool = ThreadPoolExecutor(workers)
+        self.closing = False
+        # connections handed to the pool that no worker has picked up yet
+        self.queued = 0
+        self.queued_lock = threading.Lock()
+
+    def waiting(self):
+        return self.queued > 0
+
+    def process_request(self, request, client_address):
+        with self.queued_lock:
+            self.queued += 1
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        with self.queued_lock:
+            self.queued -= 1
+        try:
+            if not self.closing:
+                self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # idle connections notice within IDLE_POLL and queued ones are closed unanswered, so only
+        # requests already being answered are waited for
+        self.closing = True
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve batched trail recommendations and name search over HTTP/JSON.')
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--quiet', action='store_true', help='no per-request log lines')
+    args = parser.parse_args()
+    # build the indexes up front so the first request does not pay for it
+    get_recommender(args.data)
+    server = RecommenderServer((args.host, args.port), data=args.data, workers=args.workers, quiet=args.quiet)
+    print(f"serving {args.data} on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from trail_search import normalize, trigrams
+from spatial_index import haversine_km
+
+# spellings that differ between WalkingKiwi and the DOC exports, on top of Tk/Trk -> track
+LINK_ABBREVIATIONS = {'rd': 'road', 'mt': 'mount', 'jcn': 'junction', 'jnc': 'junction', 'junctn': 'junction',
+                      'crk': 'creek', 'sh': 'state highway', 'mtb': 'mountain bike', 'nth': 'north', 'sth': 'south'}
+# tokens shared by more than this many names are too common to block on
+MAX_BLOCK = 100
+# best candidate needs at least this score to count as a match
+MIN_SCORE = 0.6
+# without lengths to back up the name, the name alone has to be a closer match
+MIN_NAME_ONLY_SCORE = 0.8
+# lengths only count towards the score once the names alone are this close, agreeing lengths
+# must not lift a weak name match ('Forks Hut Tramping Track' is not 'FLAT TOP TRAMPING TRACK')
+MIN_BLEND_NAME_SCORE = 0.75
+# DOC open/closed status is only carried over from links at least this good, below it the app
+# shows the status as unknown -- a wrong "Open" is worse than none
+MIN_STATUS_SCORE = 0.8
+# DOC exports linked in, looked for next to the track csv
+SOURCE_FILES = {'doc_tracks': 'DOC_Tracks.csv', 'doc_experiences': 'DOC_Walking_Experiences.csv'}
+# candidates further apart than this are never the same track, when both sides have coordinates
+MAX_DISTANCE_KM = 25
+# -----------------------------------------------------
+def link_key(name):
+    return ' '.join(LINK_ABBREVIATIONS.get(w, w) for w in normalize(name).split())
+
+def length_agreement(a_km, b_km):
+    # 1 when both lengths agree, falling to 0 as one becomes double the other, NaN when either is unknown
+    return 1 - np.minimum(1, np.abs(a_km - b_km) / np.maximum(np.maximum(a_km, b_km), 1e-9))
+# -----------------------------------------------------
+# blocked fuzzy matching: only names sharing a reasonably rare token are ever compared
+def link(left_names, right_names, left_km=None, right_km=None, left_pos=None, right_pos=None,
+         max_block=MAX_BLOCK, min_score=MIN_SCORE, max_distance_km=MAX_DISTANCE_KM,
+         min_blend_name_score=MIN_BLEND_NAME_SCORE):
+    """Best match in `right` for every row of `left`.
+
+    Names are compared on trigram Dice similarity. Lengths, when given for both
+    sides, count for a fifth of the score of candidates whose names alone score at
+    least min_blend_name_score. Positions (lat, lon) rule out candidates
+    further apart than max_distance_km. Returns (match, score, stats): match is the
+    right row for each left row or -1.
+    """
+    start = time.perf_counter()
+    left_keys = [link_key(n) for n in left_names]
+    right_keys = [link_key(n) for n in right_names]
+    right_grams = [trigrams(k) for k in right_keys]
+    # token -> right rows, dropping tokens too common to narrow anything down
+    blocks = {}
+    for row, key in enumerate(right_keys):
+        for token in set(key.split()):
+            blocks.setdefault(token, []).append(row)
+    blocks = {token: rows for token, rows in blocks.items() if len(rows) <= max_block}
+
+    match = np.full(len(left_keys), -1, dtype=np.int64)
+    score = np.zeros(len(left_keys), dtype=np.float32)
+    compared = 0
+    for row, key in enumerate(left_keys):
+        cands = {c for token in set(key.split()) for c in blocks.get(token, ())}
+        if not cands:
+            continue
+        cands = np.fromiter(cands, dtype=np.int64)
+        if left_pos is not None and right_pos is not None:
+            near = haversine_km(left_pos[0][row], left_pos[1][row], right_pos[0][cands], right_pos[1][cands])
+            cands = cands[~(near > max_distance_km)]
+        compared += len(cands)
+        grams = trigrams(key)
+        sims = np.array([2 * len(grams & right_grams[c]) / (len(grams) + len(right_grams[c])) for c in cands])
+        if left_km is not None and right_km is not None:
+            agree = length_agreement(left_km[row], right_km[cands])
+            sims = np.where(np.isnan(agree) | (sims < min_blend_name_score), sims, 0.8 * sims + 0.2 * agree)
+        if len(sims) and sims.max() >= min_score:
+            best = int(np.argmax(sims))
+            match[row], score[row] = cands[best], sims[best]
+    stats = {'rows': len(left_keys), 'candidates': len(right_keys), 'compared': compared,
+             'matched': int((match >= 0).sum()), 'match_rate': round(float((match >= 0).mean()) if len(match) else 0.0, 4),
+             'naive_comparisons': len(left_keys) * len(right_keys), 'seconds': round(time.perf_counter() - start, 3)}
+    return match, score, stats
+# -----------------------------------------------------
+# enrichment stage: DOC status, type and difficulty for the WalkingKiwi tracks
+def _take(values, match, fill=''):
+    out = np.full(len(match), fill, dtype=object)
+    out[match >= 0] = np.asarray(values, dtype=object)[match[match >= 0]]
+    return pd.Series(out).fillna(fill).astype(str).to_numpy(dtype=object)
+
+def _positions(df):
+    lon_col = 'lon' if 'lon' in df.columns else 'lng'
+    if 'lat' in df.columns and lon_col in df.columns:
+        return df['lat'].to_numpy(dtype=np.float64), df[lon_col].to_numpy(dtype=np.float64)
+    return None
+
+def enrich(df, doc_tracks=None, doc_experiences=None):
+    """DOC attributes linked onto df's rows, as a dict of columns plus linkage stats.
+
+    Every column is present even when its source is missing, so the compiled
+    dataset always has the same schema.
+    """
+    columns = {}
+    report = {}
+    length_km = df['length_km'].to_numpy(dtype=np.float64) if 'length_km' in df.columns else None
+    positions = _positions(df)
+    match = np.full(len(df), -1)
+    score = np.zeros(len(df), dtype=np.float32)
+    if doc_tracks is not None:
+        # DOC shape lengths are in metres
+        match, score, report['doc_tracks'] = link(df['name'], doc_tracks['DESCRIPTION'], length_km,
+                                                  doc_tracks['SHAPE_Length'].to_numpy(dtype=np.float64) / 1000,
+                                                  positions, _positions(doc_tracks))
+    columns['docStatus'] = _take(doc_tracks['STATUS'], match) if doc_tracks is not None else _take([], match)
+    # a low confidence link keeps its other DOC attributes, but not an open/closed status
+    columns['docStatus'][score < MIN_STATUS_SCORE] = ''
+    columns['docLinkScore'] = score
+    if doc_tracks is not None:
+        report['doc_tracks']['status_withheld'] = int(((match >= 0) & (score < MIN_STATUS_SCORE)).sum())
+    columns['docObjectType'] = _take(doc_tracks['OBJECT_TYPE_DESCRIPTION'], match) if doc_tracks is not None else _take([], match)
+
+    match = np.full(len(df), -1)
+    if doc_experiences is not None:
+        # walking experiences bundle several tracks, so their lengths say little and are left out
+        match, _, report['doc_experiences'] = link(df['name'], doc_experiences['name'],
+                                                   left_pos=positions, right_pos=_positions(doc_experiences),
+                                                   min_score=MIN_NAME_ONLY_SCORE)
+    for col, source in [('docDifficulty', 'difficulty'), ('docCompletionTime', 'completionTime'),
+                        ('docIntroduction', 'introduction')]:
+        columns[col] = _take(doc_experiences[source], match) if doc_experiences is not None else _take([], match)
+    # DOC writes an empty difficulty list as '[]'
+    columns['docDifficulty'][columns['docDifficulty'] == '[]'] = ''
+    return columns, report
+
+def load_sources(data_dir):
+    # the DOC exports that sit next to the track csv, None for any that are missing
+    sources = {}
+    for key, filename in SOURCE_FILES.items():
+        path = os.path.join(data_dir, filename)
+        # utf-8-sig drops the byte order mark the DOC exports start with
+        sources[key] = pd.read_csv(path, encoding='utf-8-sig') if os.path.exists(path) else None
+    return sources
+
+if __name__ == '__main__':
+    # python record_linkage.py data/WalkingKiwi_Tracks5.csv -- prints match rates and runtimes
+    csv_path = sys.argv[1]
+    df = pd.read_csv(csv_path, index_col=0)
+    columns, report = enrich(df, **load_sources(os.path.dirname(csv_path) or '.'))
+    for source, stats in report.items():
+        print(f"{source:>16}: {stats['matched']}/{stats['rows']} matched ({stats['match_rate']:.1%}), "
+              f"{stats['compared']:,} comparisons instead of {stats['naive_comparisons']:,}, {stats['seconds']}s")
+        if 'status_withheld' in stats:
+            print(f"{'':>16}  status withheld on {stats['status_withheld']} links scoring below {MIN_STATUS_SCORE}")
@@ -0,0 +1,212 @@
+import re
+import json
+import time
+import argparse
+import datetime
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+BASE_URL = 'https://walkingkiwi.co.nz'
+# responses worth retrying, everything else is final
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# -----------------------------------------------------
+# parsing -- same fields the Cumulative_Scraping and Regions_Scrape notebooks pulled out by hand
+def parse_track_list(html):
+    # front page lists every track as a `var trackLocation = {...}` object in a script tag
+    tracks = []
+    for block in re.findall(r'var trackLocation = \{(.*?)\};', html, flags=re.S):
+        fields = dict(re.findall(r"^\s*(\w+):\s*'?(.*?)'?,?\s*$", block, flags=re.M))
+        tracks.append({'name': fields.get('name', '').strip(), 'type': fields.get('type'),
+                       'time': fields.get('time'), 'length_km': fields.get('length', '').rstrip('km'),
+                       'lng': fields.get('lng'), 'lat': fields.get('lat'), 'url': fields.get('url')})
+    return tracks
+
+def _script_var(script, name):
+    match = re.search(rf'var {name} = (.*?);', script, flags=re.S)
+    return match.group(1).strip() if match else None
+
+def parse_track_page(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    record = {}
+    # elevation profile and geometry live in the second script tag
+    scripts = soup.find_all('script')
+    script = str(scripts[1]) if len(scripts) > 1 else ''
+    coords = _script_var(script, 'coordArray')
+    record['coordinates'] = coords.strip('[]').lstrip('", ').rstrip('"') if coords else None
+    elev = _script_var(script, 'elevArray')
+    record['trackElevation'] = elev.strip('[]') if elev else None
+    for name in ('maxElevation', 'minElevation'):
+        value = _script_var(script, name)
+        record[name] = value.strip("'") if value else None
+    # stats box under the elevation graph: max elevation, length, total ascent and duration
+    graph = soup.find('div', {'class': 'content-box', 'id': 'graph-container'})
+    content = []
+    for child in graph.findChildren('div', {'class': 'stat-text'}) if graph else []:
+        child = str(child)
+        child = child.replace('<div class="stat-text">\n', '').replace('                    ', '')
+        child = child.replace('\n<!-- ', ';').replace(' (', ';').replace(') -->\n</div>', '')
+        content.append(child.split(';'))
+    if len(content) >= 2:
+        record['length'] = content[0][1] if len(content[0]) > 1 else None
+        record['totalAscent'] = content[1][0]
+        record['duration'] = content[1][1] if len(content[1]) > 1 else None
+    # region comes from the page description
+    meta = soup.find('meta', {'name': 'description'})
+    match = re.search(r' in the (.+?) region of New Zealand', meta.get('content', '')) if meta else None
+    record['region'] = match.group(1) if match else None
+    soup.decompose()
+    return record
+# -----------------------------------------------------
+# politeness -- at most `rate` requests per second to any one host, shared by all workers
+class HostRateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+# -----------------------------------------------------
+# resumable checkpoint -- one json line per finished track, flushed as soon as it is written
+def read_checkpoint(path):
+    # latest record per url, a missing file just means nothing is done yet
+    records = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a crash can leave a half written last line behind
+                    continue
+                records[record['url']] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+def end_partial_line(path):
+    # appending straight after a half written last line would garble the next record too
+    try:
+        with open(path, 'rb+') as f:
+            if f.seek(0, 2) == 0:
+                return
+            f.seek(-1, 2)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    except FileNotFoundError:
+        pass
+
+class TrackScraper:
+    def __init__(self, base_url=BASE_URL, workers=8, rate=4.0, retries=4, backoff=0.5, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = HostRateLimiter(rate)
+        # one pooled session for every request instead of a new Session per track
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def track_url(self, url):
+        return f"{self.base_url}/track/{url}"
+
+    def get(self, url, headers=None):
+        # GET with retries and exponential backoff on connection errors and retryable statuses
+        for attempt in range(self.retries + 1):
+            self.limiter.wait(url)
+            try:
+                page = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+            else:
+                if page.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return page
+                retry_after = page.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    time.sleep(int(retry_after))
+                    continue
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def list_tracks(self):
+        page = self.get(self.base_url + '/')
+        page.raise_for_status()
+        return parse_track_list(page.text)
+
+    def fetch_track(self, url, previous=None):
+        # conditional request when we already have this track, a 304 keeps the previous record
+        headers = {}
+        if previous:
+            if previous.get('etag'):
+                headers['If-None-Match'] = previous['etag']
+            if previous.get('last_modified'):
+                headers['If-Modified-Since'] = previous['last_modified']
+        page = self.get(self.track_url(url), headers=headers)
+        fetched_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        if page.status_code == 304 and previous:
+            # a failed retry keeps the last good record, which the 304 has just confirmed
+            record = dict(previous, status=304, fetched_at=fetched_at)
+            record.pop('error', None)
+            return record
+        page.raise_for_status()
+        record = parse_track_page(page.text)
+        record.update(url=url, status=page.status_code, fetched_at=fetched_at,
+                      etag=page.headers.get('ETag'), last_modified=page.headers.get('Last-Modified'))
+        return record
+
+    def scrape(self, tracks, checkpoint, refresh=False):
+        """Fetch the page of every track, appending each result to the `checkpoint` jsonl file.
+
+        `tracks` are the front page entries from list_tracks(); their name, type,
+        time, length and position are merged into each record. Tracks already in
+        the checkpoint are skipped, so a crashed run picks up where it stopped. With
+        refresh=True every track is revisited with a conditional request instead.
+        Returns the latest record per url.
+        """
+        tracks = {track['url']: track for track in tracks}
+        done = read_checkpoint(checkpoint)
+        end_partial_line(checkpoint)
+        if refresh:
+            todo = list(tracks)
+        else:
+            todo = [url for url in tracks if url not in done or 'error' in done[url]]
+        with open(checkpoint, 'a', encoding='utf-8') as out, ThreadPoolExecutor(self.workers) as pool:
+            futures = {pool.submit(self.fetch_track, url, done.get(url) if refresh else None): url for url in todo}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    # the front page listing is current, so it wins over a kept 304 record
+                    record = dict(future.result(), **tracks[url])
+                except Exception as err:
+                    # recorded so the run carries on, the next run tries it again
+                    record = dict(done.get(url, {}), **tracks[url], error=f"{type(err).__name__}: {err}")
+                done[url] = record
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+        return done
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scrape per-track pages from WalkingKiwi into a resumable jsonl checkpoint.')
+    parser.add_argument('--out', default='data/walkingkiwi_tracks.jsonl', help='checkpoint file, appended to and resumed from')
+    parser.add_argument('--refresh', action='store_true', help='revisit every track with conditional requests')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=4.0, help='max requests per second to the host')
+    parser.add_argument('--base-url', default=BASE_URL)
+    args = parser.parse_args()
+    scraper = TrackScraper(base_url=args.base_url, workers=args.workers, rate=args.rate)
+    records = scraper.scrape(scraper.list_tracks(), args.out, refresh=args.refresh)
+    failed = sum('error' in r for r in records.values())
+    print(f"{len(records)} tracks in {args.out}, {failed} failed")
@@ -0,0 +1,80 @@
+import numpy as np
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS_KM = 6371.0088
+# -----------------------------------------------------
+def haversine_km(lat, lon, lats, lons):
+    # great circle distance from one point to many, all in degrees
+    lat, lon, lats, lons = map(np.radians, (lat, lon, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+# -----------------------------------------------------
+# ball tree over trailhead positions, built once per dataset version
+class SpatialIndex:
+    def __init__(self, lat, lon, leaf_size=40):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.tree = BallTree(np.radians(np.column_stack([self.lat, self.lon])), leaf_size=leaf_size, metric='haversine')
+
+    @classmethod
+    def from_frame(cls, df, **kwargs):
+        return cls(df['lat'], df['lon'], **kwargs)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _point(self, lat, lon):
+        return np.radians([[lat, lon]])
+
+    def within(self, lat, lon, radius_km, mask=None):
+        """Rows within radius_km of (lat, lon), closest first, with their distances in km."""
+        ids, dist = self.tree.query_radius(self._point(lat, lon), r=radius_km / EARTH_RADIUS_KM,
+                                           return_distance=True, sort_results=True)
+        ids, dist = ids[0], dist[0] * EARTH_RADIUS_KM
+        if mask is not None:
+            keep = mask[ids]
+            ids, dist = ids[keep], dist[keep]
+        return ids, dist
+
+    def nearest(self, lat, lon, k, mask=None):
+        # k closest rows passing mask, widening the search until enough survive the filter
+        n = len(self)
+        n_allowed = n if mask is None else int(np.count_nonzero(mask))
+        k = min(k, n_allowed)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+        fetch = min(n, max(k, int(np.ceil(k * n / n_allowed * 1.5))))
+        while True:
+            dist, ids = self.tree.query(self._point(lat, lon), k=fetch)
+            dist, ids = dist[0] * EARTH_RADIUS_KM, ids[0]
+            if mask is not None:
+                keep = mask[ids]
+                dist, ids = dist[keep], ids[keep]
+            if len(ids) >= k or fetch == n:
+                return ids[:k], dist[:k]
+            fetch = min(n, fetch * 2)
+
+    def within_mask(self, row, radius_km):
+        # boolean row mask of trails within radius_km of trail `row`, to AND with the parameter filter
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.within(self.lat[row], self.lon[row], radius_km)[0]] = True
+        return mask
+# -----------------------------------------------------
+# blended ranking: how similar the hike is plus how far you would have to travel to it
+def blended_query(row, k, rec_index, spatial_index, mask=None, radius_km=None, geo_weight=1.0, geo_scale_km=50.0):
+    """Top k rows by feature distance + geo_weight * travel km / geo_scale_km.
+
+    With radius_km only trails that close to `row` are considered, so "similar hikes
+    within 50 km" is radius_km=50, geo_weight=0. Returns row ids and blended scores.
+    """
+    lat, lon = spatial_index.lat[row], spatial_index.lon[row]
+    if radius_km is not None:
+        ids, travel_km = spatial_index.within(lat, lon, radius_km, mask=mask)
+    else:
+        ids = np.arange(len(spatial_index)) if mask is None else np.flatnonzero(mask)
+        travel_km = haversine_km(lat, lon, spatial_index.lat[ids], spatial_index.lon[ids])
+    features = rec_index.features
+    similarity = np.sqrt(((features[ids].astype(np.float64) - features[row]) ** 2).sum(axis=1))
+    score = similarity + geo_weight * travel_km / geo_scale_km
+    order = np.lexsort((ids, score))[:k]
+    return ids[order], score[order]
@@ -0,0 +1,149 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# bump whenever the generated data changes so cached catalogs get regenerated
+GENERATOR_VERSION = 1
+# catalog sizes the benchmarks are run at: today's catalog, and the two expansion targets
+SIZES = {'3k': 3_000, '100k': 100_000, '1m': 1_000_000}
+# trail types and how often WalkingKiwi uses each
+TYPES = {'Tramping Track': 0.457, 'Walking Track': 0.299, 'Route': 0.085, 'Short Walk': 0.070,
+         'Easy Tramping Track': 0.049, 'Great Walk': 0.021, 'Short Walk(disabled)': 0.013, 'Track - historic': 0.006}
+# region -> (centre lat, centre lon, spread in degrees, share of trails), roughly where the DOC tracks sit
+REGIONS = {
+    'Northland': (-35.5, 174.0, 0.5, 0.04), 'Auckland': (-36.9, 174.7, 0.3, 0.04),
+    'Waikato': (-37.8, 175.5, 0.5, 0.07), 'Bay Of Plenty': (-38.2, 176.6, 0.4, 0.05),
+    'Gisborne': (-38.4, 177.8, 0.3, 0.02), "Hawke's Bay": (-39.5, 176.6, 0.4, 0.04),
+    'Taranaki': (-39.3, 174.1, 0.3, 0.03), 'Manawatu-Wanganui': (-39.6, 175.6, 0.5, 0.06),
+    'Wellington': (-41.1, 175.3, 0.3, 0.05), 'Tasman': (-41.3, 172.6, 0.5, 0.09),
+    'Nelson': (-41.3, 173.3, 0.2, 0.02), 'Marlborough': (-41.7, 173.6, 0.4, 0.05),
+    'West Coast': (-42.5, 171.4, 0.7, 0.12), 'Canterbury': (-43.3, 171.7, 0.7, 0.13),
+    'Otago': (-44.9, 169.6, 0.6, 0.11), 'Southland': (-45.7, 167.8, 0.6, 0.08),
+}
+# last word of the trail name, weighted like the scraped names
+SUFFIXES = {'Track': 0.55, 'Walk': 0.10, 'Route': 0.07, 'Hut': 0.05, 'Tk': 0.05, 'Walkway': 0.03, 'Loop': 0.03,
+            'Trk': 0.02, 'Section': 0.02, 'Easement': 0.02, 'Saddle': 0.02, 'Stream Track': 0.02, 'Junction': 0.02}
+SYLLABLES = ['ka', 'ki', 'ko', 'ma', 'mo', 'ta', 'to', 'te', 'ti', 'wa', 'wai', 'whe', 'ra', 'ro', 'ru', 'ha', 'he',
+             'ho', 'pa', 'pu', 'nga', 'ngo', 'ara', 'iti', 'roa', 'nui', 'mā', 'kō', 'tū', 'rā', 'hau', 'pō']
+# metres between recorded points along a track
+POINT_SPACING_M = 100
+# -----------------------------------------------------
+def _weighted(rng, table, n):
+    keys = list(table)
+    p = np.array([table[k] for k in keys], dtype=np.float64)
+    return np.array(keys, dtype=object)[rng.choice(len(keys), size=n, p=p / p.sum())]
+
+def _place_names(rng, n):
+    # two to four syllables, capitalised -- Kōtawai, Rurongā, ...
+    count = rng.integers(2, 5, n)
+    picks = rng.integers(0, len(SYLLABLES), (n, 4))
+    return [''.join(SYLLABLES[s] for s in row[:c]).capitalize() for row, c in zip(picks, count)]
+
+def _names(rng, n):
+    start, end = _place_names(rng, n), _place_names(rng, n)
+    suffix = _weighted(rng, SUFFIXES, n)
+    # about one in five is a section between two places, like the hut-to-hut tracks
+    between = rng.random(n) < 0.2
+    return [f"{a} to {b} {s}" if bt else f"{a} {s}" for a, b, s, bt in zip(start, end, suffix, between)]
+
+def generate(n, seed=0, start_row=0, spacing_m=POINT_SPACING_M):
+    """A synthetic WalkingKiwi catalog of n trails, in the WalkingKiwi_Tracks5.csv schema.
+
+    Lengths, times, types and regions follow the scraped data. Every track has a
+    `coordinates` and a `trackElevation` string in the scraped formats, with
+    elevation stats derived from the profile so the columns agree with each other.
+    """
+    rng = np.random.default_rng([seed, start_row])
+    length_km = np.clip(np.round(rng.lognormal(1.12, 1.25, n), 2), 0.05, 45.0)
+    # DOC walking times work out at a little under 2 km/h, slower on the longer backcountry tracks
+    speed = rng.lognormal(np.log(1.8), 0.35, n) / (1 + 0.01 * length_km)
+    time_h = np.clip(np.round(length_km / speed, 2), 0.1, 48.0)
+    region = _weighted(rng, {k: v[3] for k, v in REGIONS.items()}, n)
+    centre = np.array([REGIONS[r][:3] for r in region])
+    lat = centre[:, 0] + rng.normal(0, 1, n) * centre[:, 2]
+    lon = centre[:, 1] + rng.normal(0, 1, n) * centre[:, 2]
+
+    points = np.clip(np.round(length_km * 1000 / spacing_m).astype(np.int64) + 1, 5, 2000)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(points)
+    trail = np.repeat(np.arange(n), points)
+    first = offsets[:-1]
+    # elevation: a drifting random walk from a start height, rougher where the trail starts higher
+    start_elev = np.clip(rng.exponential(350, n), 0, 2500)
+    drift = rng.normal(0, 3, n)
+    steps = drift[trail] + rng.normal(0, 1, len(trail)) * (8 + start_elev[trail] / 60)
+    steps[first] = 0
+    elev = np.clip(start_elev[trail] + _segment_cumsum(steps, offsets), 0, 3700)
+    # geometry: a meandering walk away from the trailhead, one point every spacing_m
+    heading = rng.uniform(0, 2 * np.pi, n)[trail] + _segment_cumsum(rng.normal(0, 0.3, len(trail)), offsets)
+    step_deg = spacing_m / 111_320
+    dlat = np.cos(heading) * step_deg
+    dlon = np.sin(heading) * step_deg / np.cos(np.radians(lat[trail]))
+    dlat[first], dlon[first] = 0, 0
+    path_lat = lat[trail] + _segment_cumsum(dlat, offsets)
+    path_lon = lon[trail] + _segment_cumsum(dlon, offsets)
+
+    rise = np.diff(elev)
+    within = trail[1:] == trail[:-1]
+    total_ascent = np.bincount(trail[1:][within], weights=np.clip(rise[within], 0, None), minlength=n)
+    min_elev = np.minimum.reduceat(elev, first)
+    max_elev = np.maximum.reduceat(elev, first)
+    names = _names(rng, n)
+    df = pd.DataFrame({
+        'name': names,
+        'type': _weighted(rng, TYPES, n),
+        'time_h': time_h,
+        'length_km': length_km,
+        'minElevation': np.round(min_elev, 1),
+        'maxElevation': np.round(max_elev, 1),
+        'netElevation': np.round(max_elev - min_elev, 1),
+        'totalAscent': np.round(total_ascent, 1),
+        'lon': np.round(lon, 6),
+        'lat': np.round(lat, 6),
+        # 'lon,lat lon,lat ...' and '12.5,13.0,...', as scraped
+        'coordinates': _join_rows(np.char.add(np.char.add(np.char.mod('%.6f', path_lon), ','),
+                                              np.char.mod('%.6f', path_lat)), offsets, ' '),
+        'trackElevation': _join_rows(np.char.mod('%.6f', elev), offsets, ','),
+        'url': [f"{'-'.join(name.lower().split())}-{row}" for row, name in enumerate(names, start_row)],
+        'region': region,
+    }, index=pd.RangeIndex(start_row, start_row + n))
+    return df
+
+def _segment_cumsum(values, offsets):
+    # running sum restarting at each trail, values at each trail's first point are the starting offsets
+    total = np.cumsum(values)
+    before = np.r_[0, total[offsets[1:-1] - 1]]
+    return total - np.repeat(before, np.diff(offsets))
+
+def _join_rows(strings, offsets, sep):
+    strings = strings.tolist()
+    return [sep.join(strings[offsets[i]:offsets[i+1]]) for i in range(len(offsets) - 1)]
+# -----------------------------------------------------
+# on-disk catalogs, written a chunk at a time so 1M rows never sit in memory at once
+def catalog_path(out_dir, n, seed=0):
+    return os.path.join(out_dir, f"synthetic-g{GENERATOR_VERSION}-{n}-s{seed}", 'WalkingKiwi_Tracks5.csv')
+
+def write_catalog(path, n, seed=0, chunk_rows=50_000):
+    # atomic like the compiled store -- a crash never leaves a truncated catalog behind
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.partial'
+    for start in range(0, n, chunk_rows):
+        chunk = generate(min(chunk_rows, n - start), seed=seed, start_row=start)
+        chunk.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0)
+    os.replace(tmp_path, path)
+    return path
+
+def ensure_catalog(out_dir, n, seed=0):
+    # reuse a catalog generated earlier with the same generator version, size and seed
+    path = catalog_path(out_dir, n, seed)
+    return path if os.path.exists(path) else write_catalog(path, n, seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic WalkingKiwi catalog for benchmarking.')
+    parser.add_argument('size', help=f"number of trails or one of {', '.join(SIZES)}")
+    parser.add_argument('--out-dir', default='data/synthetic')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    n = SIZES.get(args.size) or int(args.size)
+    print(ensure_catalog(args.out_dir, n, args.seed))
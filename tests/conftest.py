@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# the modules under test sit at the top of the repo, next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthetic_trails
+from recommender_core import Recommender
+
+# big enough for every filter combination to leave some trails, small enough to compile in a second
+CATALOG_TRAILS = 3_000
+# -----------------------------------------------------
+@pytest.fixture(scope='session')
+def catalog(tmp_path_factory):
+    # a synthetic catalog, compiled into its store on first use like the real one
+    return synthetic_trails.ensure_catalog(str(tmp_path_factory.mktemp('synthetic')), CATALOG_TRAILS)
+
+@pytest.fixture(scope='session')
+def recommender(catalog):
+    return Recommender(catalog)
@@ -0,0 +1,58 @@
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics.pairwise import euclidean_distances
+
+# the original recommender_app.py functions the indexes replaced, kept as the reference their results are checked against
+# -----------------------------------------------------
+def param_filter(df, region_opt, time_opt, length_opt, ascent_opt):
+    filtered_df = df.copy(deep=True)
+
+    if region_opt != 'All Regions':
+        filtered_df = filtered_df[filtered_df['region'] == region_opt]
+
+    if time_opt == 'Short (< 1 hour)':
+        filtered_df = filtered_df[filtered_df['time_h'] < 1]
+    elif time_opt == 'Medium (1 - 5 hours)':
+        filtered_df = filtered_df[(filtered_df['time_h'] >= 1) & (filtered_df['time_h'] < 5)]
+    elif time_opt == 'Long (5+ hours)':
+        filtered_df = filtered_df[filtered_df['time_h'] >= 5]
+
+    if length_opt == 'Short (< 5 km)':
+        filtered_df = filtered_df[filtered_df['length_km'] < 5]
+    elif length_opt == 'Medium (5 - 10 km)':
+        filtered_df = filtered_df[(filtered_df['length_km'] >= 5) & (df['length_km'] < 10)]
+    elif length_opt == 'Long (10+ km)':
+        filtered_df = filtered_df[filtered_df['length_km'] >= 10]
+
+    if ascent_opt == 'Easy (< 100 m)':
+        filtered_df = filtered_df[filtered_df['totalAscent'] < 100]
+    elif ascent_opt == 'Moderate (100 - 600 m)':
+        filtered_df = filtered_df[(filtered_df['totalAscent'] >= 100) & (df['totalAscent'] < 600)]
+    elif ascent_opt == 'Challenging (600+ m)':
+        filtered_df = filtered_df[filtered_df['totalAscent'] >= 600]
+
+    return filtered_df
+
+def euclidean_rec(title, df, filtered_df, num_of_rec):
+    trail_recomm = df[['name','time_h','length_km','netElevation','totalAscent']]
+    X = trail_recomm.drop(columns='name').values
+    # Standardize the features so that no feature dominates the distance computations due to unit scale
+    scaler = StandardScaler().fit(X)
+    X = scaler.transform(X)
+    # the hike you searched for
+    hike_lookup = trail_recomm.loc[trail_recomm['name'] == title]
+    hike_lookup = hike_lookup.drop(columns='name').values
+    hike_lookup = scaler.transform(hike_lookup)
+    # Distance from all other hikes
+    distances = euclidean_distances(X, hike_lookup)
+    distances = distances.reshape(-1)
+    # Find the indices with the minimum distance (highest similarity) to the hike we're looking at
+    ordered_indices = distances.argsort()
+    closest_indices = ordered_indices[:2500]
+    # Get the hikes for these indices and relate back to original df or filtered df if appropriate
+    closest_trails = trail_recomm.iloc[closest_indices]
+    hike_names = closest_trails['name'].tolist()
+    result_df = filtered_df[filtered_df['name'].isin(hike_names)][['name','region','type','time_h','length_km','totalAscent','trackElevation','lat','lon','coordinates']]
+    result_df = result_df.iloc[pd.Categorical(result_df['name'], categories=hike_names, ordered=True).argsort()]
+
+    return result_df[:num_of_rec+1]
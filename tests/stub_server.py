@@ -0,0 +1,86 @@
+import os
+import hashlib
+import argparse
+import threading
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# recorded walkingkiwi.co.nz pages: index.html is the front page, track/<url>.html the track pages
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+# -----------------------------------------------------
+# local stand-in for walkingkiwi.co.nz, so the scraper runs offline
+class StubServer:
+    """Serves the recorded pages with ETags and answers If-None-Match with a 304.
+
+    `fail[path]` is a list of statuses to answer that path with before serving it,
+    and `hits[path]` counts the requests per path.
+    """
+    def __init__(self, pages_dir=PAGES_DIR, host='127.0.0.1', port=0):
+        self.pages_dir = pages_dir
+        self.fail = defaultdict(list)
+        self.hits = Counter()
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = None
+
+    def page_path(self, path):
+        return os.path.join(self.pages_dir, 'index.html' if path == '/' else path.lstrip('/') + '.html')
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub.lock:
+                    stub.hits[self.path] += 1
+                    status = stub.fail[self.path].pop(0) if stub.fail[self.path] else None
+                if status is not None:
+                    return self._send(status)
+                try:
+                    with open(stub.page_path(self.path), 'rb') as f:
+                        body = f.read()
+                except FileNotFoundError:
+                    return self._send(404)
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self._send(304, headers={'ETag': etag})
+                self._send(200, body, {'ETag': etag, 'Content-Type': 'text/html; charset=utf-8'})
+
+            def _send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                if status != 304:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+if __name__ == '__main__':
+    # python tests/stub_server.py --port 8000, then python scraper.py --base-url http://127.0.0.1:8000
+    parser = argparse.ArgumentParser(description='Serve the recorded WalkingKiwi pages locally.')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    server = StubServer(port=args.port)
+    print(f"serving {PAGES_DIR} on {server.base_url}")
+    server.httpd.serve_forever()
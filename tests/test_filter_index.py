@@ -0,0 +1,70 @@
+import itertools
+import numpy as np
+import pytest
+import legacy
+import synthetic_trails
+from conftest import CATALOG_TRAILS
+from filter_index import ALL_REGIONS, BUCKETS, FilterIndex
+
+COLUMNS = ['region', 'time_h', 'length_km', 'totalAscent']
+# the original filter mixes masks of df and the already filtered frame, which pandas warns about
+pytestmark = pytest.mark.filterwarnings('ignore:Boolean Series key will be reindexed:UserWarning')
+# -----------------------------------------------------
+@pytest.fixture(scope='module')
+def frame():
+    # a synthetic catalog with some values missing in every filtered column
+    df = synthetic_trails.generate(CATALOG_TRAILS, seed=2)[COLUMNS]
+    rng = np.random.default_rng(3)
+    for col in COLUMNS:
+        df.loc[rng.choice(len(df), 50, replace=False), col] = np.nan
+    # a few values right on the bucket edges
+    for col, buckets in BUCKETS.items():
+        edges = sorted({edge for bounds in buckets.values() for edge in bounds if edge is not None})
+        df.loc[rng.choice(len(df), len(edges), replace=False), col] = edges
+    return df
+
+@pytest.fixture(scope='module')
+def index(frame):
+    return FilterIndex(frame)
+
+def options(col):
+    # every dropdown label for the column, plus the app's unfiltered first entry
+    return ['All'] + list(BUCKETS[col])
+
+def rows(index, bits):
+    return np.flatnonzero(index.mask(bits))
+# -----------------------------------------------------
+def test_every_combination_matches_original_param_filter(frame, index):
+    regions = [ALL_REGIONS] + index.regions
+    combinations = itertools.product(regions, options('time_h'), options('length_km'), options('totalAscent'))
+    for region, time, length, ascent in combinations:
+        expected = legacy.param_filter(frame, region, time, length, ascent).index.to_numpy()
+        bits = index.query(region, buckets={'time_h': time, 'length_km': length, 'totalAscent': ascent})
+        np.testing.assert_array_equal(rows(index, bits), expected, err_msg=str((region, time, length, ascent)))
+
+@pytest.mark.parametrize('ranges', [
+    {'time_h': (2.5, 7.25)},
+    {'length_km': (None, 3.3), 'totalAscent': (250, None)},
+    {'time_h': (1, 5), 'length_km': (5, 10), 'totalAscent': (100, 600)},
+    {'totalAscent': (600, 100)},
+    {'length_km': (None, None)},
+])
+def test_ranges_match_a_plain_comparison(frame, index, ranges):
+    for region in (ALL_REGIONS, index.regions[0]):
+        keep = np.ones(len(frame), dtype=bool) if region == ALL_REGIONS else (frame['region'] == region).to_numpy(copy=True)
+        for col, (lo, hi) in ranges.items():
+            values = frame[col].to_numpy()
+            # missing values never match, not even a range open at both ends
+            keep &= ~np.isnan(values)
+            if lo is not None:
+                keep &= values >= lo
+            if hi is not None:
+                keep &= values < hi
+        bits = index.query(region, buckets={'time_h': 'Short (< 1 hour)'}, ranges=ranges)
+        expected = np.flatnonzero(keep & (frame['time_h'] < 1).to_numpy())
+        np.testing.assert_array_equal(rows(index, bits), expected)
+
+def test_missing_and_unknown_regions(frame, index):
+    # trails without a region are only found under All Regions, and are not a region of their own
+    assert index.regions == sorted(frame['region'].dropna().unique())
+    assert not index.mask(index.query('Atlantis')).any()
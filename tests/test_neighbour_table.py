@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from neighbour_table import NeighbourTable, top_k_neighbours
+from recommender_core import Recommender
+
+# neighbours kept per trail, besides the trail itself
+TABLE_K = 20
+# trails asked for, the searched one included
+K = 6
+# -----------------------------------------------------
+@pytest.fixture(scope='module')
+def table(recommender):
+    return NeighbourTable(*top_k_neighbours(recommender.rec_index.features, TABLE_K + 1))
+
+@pytest.fixture(scope='module')
+def tabled(catalog, table):
+    # a second recommender answering from the table, the shared one stays live only
+    recommender = Recommender(catalog)
+    recommender.neighbour_table = table
+    return recommender
+
+def random_mask(n, allowed, seed=0):
+    mask = np.zeros(n, dtype=bool)
+    mask[np.random.default_rng(seed).choice(n, allowed, replace=False)] = True
+    return mask
+
+def assert_same(result, expected):
+    np.testing.assert_array_equal(result[0], expected[0])
+    np.testing.assert_allclose(result[1], expected[1], rtol=1e-5, atol=1e-6)
+# -----------------------------------------------------
+@pytest.mark.parametrize('allowed', [None, 2000, 300, 30, 3])
+def test_table_matches_live_search(recommender, table, allowed):
+    index = recommender.rec_index
+    mask = None if allowed is None else random_mask(len(index), allowed)
+    rows = np.random.default_rng(1).choice(len(index), 300, replace=False)
+    answered = 0
+    for row in rows:
+        result = table.query(row, K, mask)
+        if result is not None:
+            assert_same(result, index.query(row, K, mask))
+            answered += 1
+    # without a filter the table answers everything; a 1% filter leaves the table too few neighbours
+    # for almost any trail, but whenever it does answer it agrees with the live search
+    if allowed is None or allowed >= 2000:
+        assert answered == len(rows)
+    elif allowed == 30:
+        assert answered < len(rows)
+
+def test_fallback_boundary(recommender, table):
+    index = recommender.rec_index
+    row = 7
+    stored = np.asarray(table.ids[row])
+    # trails missing from the row's table, so the table knows nothing about them
+    outside = np.setdiff1d(np.arange(len(index)), stored)[:50]
+    mask = np.zeros(len(index), dtype=bool)
+    mask[outside] = True
+    # exactly K of the stored neighbours pass the filter: the table still answers
+    mask[stored[-K:]] = True
+    result = table.query(row, K, mask)
+    assert result is not None
+    np.testing.assert_array_equal(result[0], stored[-K:])
+    assert_same(result, index.query(row, K, mask))
+    # one fewer and it has to hand over to the live search, whose answer includes trails outside the table
+    mask[stored[-1]] = False
+    assert table.query(row, K, mask) is None
+    live_ids, _ = index.query(row, K, mask)
+    assert np.isin(live_ids, outside).any()
+    # fewer trails allowed than asked for, all of them in the table: the table answers with all of them
+    mask[:] = False
+    mask[stored[3:5]] = True
+    result = table.query(row, K, mask)
+    assert result is not None and len(result[0]) == 2
+    assert_same(result, index.query(row, K, mask))
+
+@pytest.mark.parametrize('allowed', [None, 300, 30])
+def test_query_batch_matches_query(table, allowed):
+    mask = None if allowed is None else random_mask(len(table.ids), allowed)
+    rows = np.random.default_rng(2).choice(len(table.ids), 300, replace=False)
+    for result, row in zip(table.query_batch(rows, K, mask), rows):
+        expected = table.query(row, K, mask)
+        if expected is None:
+            assert result is None
+        else:
+            assert_same(result, expected)
+
+@pytest.mark.parametrize('allowed', [None, 300, 30])
+def test_recommender_with_table_matches_live(recommender, tabled, allowed):
+    mask = None if allowed is None else random_mask(len(recommender), allowed)
+    rows = np.random.default_rng(3).choice(len(recommender), 100, replace=False)
+    expected = [recommender.recommend(row, K - 1, mask=mask) for row in rows]
+    for result, want in zip([tabled.recommend(row, K - 1, mask=mask) for row in rows], expected):
+        assert_same(result, want)
+    for result, want in zip(tabled.recommend_batch(rows, K - 1, mask=mask), expected):
+        assert_same(result, want)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+import legacy
+import synthetic_trails
+from conftest import CATALOG_TRAILS
+from recommender_core import Recommender
+
+# -----------------------------------------------------
+def random_mask(n, allowed, seed=0):
+    mask = np.zeros(n, dtype=bool)
+    mask[np.random.default_rng(seed).choice(n, allowed, replace=False)] = True
+    return mask
+
+def assert_same(results, expected):
+    assert len(results) == len(expected)
+    for (ids, dist), (want_ids, want_dist) in zip(results, expected):
+        np.testing.assert_array_equal(ids, want_ids)
+        np.testing.assert_array_equal(dist, want_dist)
+# -----------------------------------------------------
+@pytest.mark.parametrize('allowed', [0, 3, 20, 2048, 2049, None])
+def test_query_batch_matches_query(recommender, allowed):
+    index = recommender.rec_index
+    mask = None if allowed is None else random_mask(len(index), allowed)
+    rows = np.random.default_rng(1).choice(len(index), 200, replace=False)
+    expected = [index.query(row, 6, mask) for row in rows]
+    assert_same(index.query_batch(rows, 6, mask), expected)
+    # blocks of a few rows each give the same answers
+    assert_same(index.query_batch(rows, 6, mask, max_block_bytes=16 * 6 * 7), expected)
+
+# region, time, length and ascent options, as the app offers them
+FILTERS = [('All Regions', 'All Lengths (h)', 'All Lengths (km)', 'All Elevations (m)'),
+           ('Otago', 'All Lengths (h)', 'All Lengths (km)', 'All Elevations (m)'),
+           ('All Regions', 'Medium (1 - 5 hours)', 'Short (< 5 km)', 'All Elevations (m)'),
+           ('Canterbury', 'All Lengths (h)', 'Medium (5 - 10 km)', 'Moderate (100 - 600 m)')]
+
+@pytest.fixture(scope='module')
+def unique_catalog(tmp_path_factory):
+    # the original looked hikes up by name and broke on repeated ones, so every name is made unique
+    df = synthetic_trails.generate(CATALOG_TRAILS, seed=1)
+    repeated = df['name'].duplicated()
+    df.loc[repeated, 'name'] = df.loc[repeated, 'name'] + ' ' + df.index[repeated].astype(str)
+    path = str(tmp_path_factory.mktemp('unique') / 'WalkingKiwi_Tracks5.csv')
+    df.to_csv(path)
+    return path, Recommender(path)
+
+@pytest.mark.parametrize('options', FILTERS)
+def test_recommend_matches_original_euclidean_rec(unique_catalog, options):
+    path, recommender = unique_catalog
+    # the original ranked the csv as the app read it, not the compiled store
+    df = pd.read_csv(path, index_col=0)
+    filtered_df = legacy.param_filter(df, *options)
+    mask = recommender.param_filter(*options)
+    assert mask.any()
+    for row in np.random.default_rng(2).choice(len(df), 100, replace=False):
+        title = df['name'].iloc[row]
+        # the searched hike itself is dropped from the original's k+1 results
+        expected = [r for r in legacy.euclidean_rec(title, df, filtered_df, 5).index if r != row][:5]
+        ids, _ = recommender.recommend(row, 5, mask=mask)
+        assert ids.tolist() == expected, title
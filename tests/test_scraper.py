@@ -0,0 +1,84 @@
+import json
+import shutil
+import pytest
+from scraper import TrackScraper, read_checkpoint
+from stub_server import PAGES_DIR, StubServer
+
+URLS = ['-ngatuhoa-stream-track', '1220-track', '3-mile-pack-track']
+# -----------------------------------------------------
+@pytest.fixture
+def server(tmp_path):
+    # a copy of the recorded pages, so a test can change one without touching the others
+    pages = tmp_path / 'pages'
+    shutil.copytree(PAGES_DIR, pages)
+    with StubServer(str(pages)) as stub:
+        yield stub
+
+@pytest.fixture
+def scraper(server):
+    # no rate limit or backoff sleeps against the local stub
+    return TrackScraper(base_url=server.base_url, workers=4, rate=0, backoff=0)
+
+def scrape(scraper, checkpoint, refresh=False):
+    return scraper.scrape(scraper.list_tracks(), str(checkpoint), refresh=refresh)
+# -----------------------------------------------------
+def test_scrape_merges_listing_fields(scraper, tmp_path):
+    records = scrape(scraper, tmp_path / 'tracks.jsonl')
+    assert sorted(records) == sorted(URLS)
+    record = records['1220-track']
+    assert (record['name'], record['type'], record['time']) == ('1220 Track', 'Tramping Track', '0h 36m')
+    assert (record['length_km'], record['lng'], record['lat']) == ('1.44', '169.034078', '-45.113130')
+    assert record['region'] == 'Otago'
+    assert record['coordinates'].startswith('169.034078,-45.113130 ')
+    assert record['status'] == 200 and record['etag']
+    # the checkpoint holds exactly what was returned
+    assert read_checkpoint(tmp_path / 'tracks.jsonl') == records
+
+def test_resume_skips_finished_tracks(server, scraper, tmp_path):
+    checkpoint = tmp_path / 'tracks.jsonl'
+    # a run that finished one track, failed another and crashed half way through writing a third
+    finished = {'url': '1220-track', 'name': '1220 Track', 'status': 200}
+    failed = {'url': '3-mile-pack-track', 'error': 'ConnectionError: reset'}
+    checkpoint.write_text(json.dumps(finished) + '\n' + json.dumps(failed) + '\n{"url": "-ngatuhoa-str')
+    records = scrape(scraper, checkpoint)
+    assert server.hits['/track/1220-track'] == 0
+    assert server.hits['/track/3-mile-pack-track'] == 1
+    assert server.hits['/track/-ngatuhoa-stream-track'] == 1
+    assert records['1220-track'] == finished
+    assert all('error' not in record for record in records.values())
+    # nothing left to do on the next run
+    scrape(scraper, checkpoint)
+    assert sum(hits for path, hits in server.hits.items() if path.startswith('/track/')) == 2
+
+def test_retries_503(server, scraper, tmp_path):
+    server.fail['/track/1220-track'] = [503, 503]
+    records = scrape(scraper, tmp_path / 'tracks.jsonl')
+    assert server.hits['/track/1220-track'] == 3
+    assert records['1220-track']['status'] == 200
+    assert records['1220-track']['region'] == 'Otago'
+
+def test_gives_up_after_retries(server, tmp_path):
+    scraper = TrackScraper(base_url=server.base_url, rate=0, backoff=0, retries=1)
+    server.fail['/track/1220-track'] = [503, 503]
+    records = scrape(scraper, tmp_path / 'tracks.jsonl')
+    assert server.hits['/track/1220-track'] == 2
+    assert records['1220-track']['error'].startswith('HTTPError')
+    # the listing fields are kept even for a failed track
+    assert records['1220-track']['name'] == '1220 Track'
+
+def test_refresh_uses_conditional_requests(server, scraper, tmp_path):
+    checkpoint = tmp_path / 'tracks.jsonl'
+    first = scrape(scraper, checkpoint)
+    # one page changes between the runs
+    page = tmp_path / 'pages' / 'track' / '1220-track.html'
+    page.write_text(page.read_text().replace('Otago', 'Southland'))
+    records = scrape(scraper, checkpoint, refresh=True)
+    assert all(server.hits[f'/track/{url}'] == 2 for url in URLS)
+    assert records['1220-track']['status'] == 200
+    assert records['1220-track']['region'] == 'Southland'
+    assert records['1220-track']['etag'] != first['1220-track']['etag']
+    for url in ['-ngatuhoa-stream-track', '3-mile-pack-track']:
+        assert records[url]['status'] == 304
+        assert records[url]['coordinates'] == first[url]['coordinates']
+        assert records[url]['name'] == first[url]['name']
+    assert read_checkpoint(checkpoint) == records
@@ -0,0 +1,78 @@
+import json
+import time
+import threading
+import http.client
+import pytest
+from recommender_service import RecommenderServer
+
+# -----------------------------------------------------
+@pytest.fixture
+def server(catalog, recommender):
+    # a single worker, so one connection holding on to it would block every other client
+    server = RecommenderServer(('127.0.0.1', 0), data=catalog, workers=1, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def connect(server):
+    return http.client.HTTPConnection(*server.server_address, timeout=3)
+
+def get(conn, path):
+    conn.request('GET', path)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+def post(conn, path, body):
+    conn.request('POST', path, body=json.dumps(body), headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+# -----------------------------------------------------
+def test_keep_alive_reuses_the_connection(server):
+    conn = connect(server)
+    for _ in range(3):
+        assert get(conn, '/health')[0] == 200
+    assert post(conn, '/search', {'queries': [{'term': 'ka'}]})[0] == 200
+
+def test_idle_connection_does_not_block_others(server):
+    idle = connect(server)
+    assert get(idle, '/health')[0] == 200
+    start = time.monotonic()
+    assert get(connect(server), '/health')[0] == 200
+    assert time.monotonic() - start < 1
+
+def test_close_does_not_wait_for_idle_connections(catalog, recommender):
+    server = RecommenderServer(('127.0.0.1', 0), data=catalog, workers=1, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    idle = connect(server)
+    assert get(idle, '/health')[0] == 200
+    start = time.monotonic()
+    server.shutdown()
+    server.server_close()
+    assert time.monotonic() - start < 2
+
+@pytest.mark.parametrize('path, query', [
+    ('/recommend', {'row': 5, 'k': -3, 'engine': 'descriptions'}),
+    ('/recommend', {'row': 5, 'k': 0}),
+    ('/search', {'term': 'ka', 'k': -1}),
+    ('/recommend', 5),
+    ('/search', 'ka'),
+    ('/viewport', [168.5, -45.2, 169.5, -44.6]),
+])
+def test_bad_queries_get_a_400(server, path, query):
+    status, body = post(connect(server), path, {'queries': [query]})
+    assert status == 400
+    assert body['error'].startswith('ValueError')
+
+def test_recommend_returns_k_trails(server):
+    status, body = post(connect(server), '/recommend', {'queries': [{'row': 5, 'k': 3, 'engine': engine}
+                                                                    for engine in ('statistics', 'descriptions')]})
+    assert status == 200
+    assert [len(result['trails']) for result in body['results']] == [3, 3]
+
+def test_nearby(server):
+    status, body = post(connect(server), '/nearby', {'queries': [{'lat': -44.0, 'lon': 170.5, 'k': 4, 'radius_km': 500}]})
+    assert status == 200
+    assert len(body['results'][0]['trails']) == 4
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from recommender_core import nearby_many
+from spatial_index import haversine_km
+
+# a point in the middle of the South Island, and one off the coast with no trailhead near it
+POINTS = [(-44.0, 170.5), (-40.0, 160.0)]
+# -----------------------------------------------------
+def brute_force(recommender, lat, lon, k, mask=None, radius_km=None):
+    index = recommender.spatial_index
+    km = haversine_km(lat, lon, index.lat, index.lon)
+    ids = np.arange(len(km)) if mask is None else np.flatnonzero(mask)
+    if radius_km is not None:
+        ids = ids[km[ids] <= radius_km]
+    return ids[np.argsort(km[ids], kind='stable')][:k], km
+
+@pytest.mark.parametrize('lat, lon', POINTS)
+@pytest.mark.parametrize('radius_km', [None, 50])
+@pytest.mark.parametrize('region', [None, 'Otago'])
+def test_nearby_matches_brute_force(recommender, lat, lon, radius_km, region):
+    mask = recommender.param_filter(region)
+    ids, km = recommender.nearby(lat, lon, 10, mask=mask, radius_km=radius_km)
+    want, all_km = brute_force(recommender, lat, lon, 10, mask, radius_km)
+    np.testing.assert_array_equal(ids, want)
+    np.testing.assert_allclose(km, all_km[ids])
+    assert mask[ids].all()
+
+def test_nearby_with_nothing_allowed(recommender):
+    ids, km = recommender.nearby(*POINTS[0], 10, mask=np.zeros(len(recommender), dtype=bool))
+    assert len(ids) == len(km) == 0
+
+def test_nearby_many(recommender):
+    results = nearby_many(recommender, [{'lat': -44.0, 'lon': 170.5, 'k': 3},
+                                        {'lat': -44.0, 'lon': 170.5, 'k': 3, 'radius_km': 0.001}])
+    assert len(results[0]['trails']) == 3
+    assert [t['score'] for t in results[0]['trails']] == sorted(t['score'] for t in results[0]['trails'])
+    assert results[1]['trails'] == []
+    with pytest.raises(ValueError):
+        nearby_many(recommender, [{'lat': 95, 'lon': 170.5}])
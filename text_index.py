@@ -0,0 +1,77 @@
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+# how much scratch memory one block of batched query results may use
+MAX_BLOCK_BYTES = 64 << 20
+# -----------------------------------------------------
+# the text we describe each trail with
+def document_texts(df):
+    # name, type and region for every trail, plus the DOC introduction linked in when the dataset was compiled
+    intros = df['docIntroduction'] if 'docIntroduction' in df.columns else [''] * len(df)
+    return [' '.join([str(name), str(kind), str(region), intro])
+            for name, kind, region, intro in zip(df['name'], df['type'], df['region'], intros)]
+# -----------------------------------------------------
+# sparse tf-idf over the trail descriptions, rows L2-normalised once at build time
+class TextIndex:
+    def __init__(self, texts):
+        self.vectorizer = CountVectorizer(strip_accents='unicode', stop_words='english')
+        counts = self.vectorizer.fit_transform(texts)
+        # unit rows, so a sparse dot product is the cosine similarity
+        self.X = TfidfTransformer(sublinear_tf=True).fit_transform(counts).astype(np.float32).tocsr()
+        self.XT = self.X.T.tocsr()
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls(document_texts(df))
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def similarities(self, row):
+        # cosine similarity of one trail to every trail, a single dense row
+        return (self.X[row] @ self.XT).toarray().ravel()
+
+    def _top_k(self, ids, sims, k, mask):
+        # best k of the candidate ids with a non-zero similarity
+        keep = sims > 0 if mask is None else (sims > 0) & mask[ids]
+        ids, sims = ids[keep], sims[keep]
+        if len(ids) > k:
+            # everything tied with the k-th best stays in, so ties always go to the lowest row ids
+            kth = -np.partition(-sims, k - 1)[k - 1]
+            ids, sims = ids[sims >= kth], sims[sims >= kth]
+        order = np.lexsort((ids, -sims))[:k]
+        return ids[order], sims[order]
+
+    def query(self, row, k, mask=None):
+        """Row ids and cosine similarities of the k trails described most like `row`."""
+        sims = self.similarities(row)
+        return self._top_k(np.arange(len(sims)), sims, k, mask)
+
+    def query_batch(self, rows, k, mask=None, max_block_bytes=MAX_BLOCK_BYTES):
+        # many queries at once, one sparse product per block of rows instead of per row; the top k is taken
+        # straight off each sparse result row, and the block is sized so that even result rows matching
+        # every trail (8 bytes a non-zero) stay within the budget
+        block = max(1, max_block_bytes // (8 * max(len(self), 1)))
+        results = []
+        for start in range(0, len(rows), block):
+            sims = (self.X[rows[start:start+block]] @ self.XT).tocsr()
+            for i in range(sims.shape[0]):
+                lo, hi = sims.indptr[i], sims.indptr[i+1]
+                results.append(self._top_k(sims.indices[lo:hi].astype(np.intp), sims.data[lo:hi], k, mask))
+        return results
+# -----------------------------------------------------
+# hybrid ranking: trail statistics and descriptions together
+def hybrid_query(row, k, rec_index, text_index, mask=None, text_weight=0.5):
+    """Top k rows by text_weight * (1 - cosine) + (1 - text_weight) * scaled feature distance.
+
+    Feature distances are divided by sqrt(2 * n_features), the typical distance between
+    two standardized trails, so both halves of the score sit on a similar 0-1ish scale.
+    """
+    ids = np.arange(len(rec_index)) if mask is None else np.flatnonzero(mask)
+    features = rec_index.features
+    feature_dist = np.sqrt(((features[ids].astype(np.float64) - features[row]) ** 2).sum(axis=1))
+    feature_dist /= np.sqrt(2 * features.shape[1])
+    text_dist = 1 - text_index.similarities(row)[ids]
+    score = text_weight * text_dist + (1 - text_weight) * feature_dist
+    order = np.lexsort((ids, score))[:k]
+    return ids[order], score[order]
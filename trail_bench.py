@@ -0,0 +1,232 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import subprocess
+import numpy as np
+import pandas as pd
+import sklearn
+import trail_store
+from filter_index import ALL_REGIONS, BUCKETS
+from recommender_core import Recommender, recommend_many
+from synthetic_trails import SIZES, ensure_catalog
+from trail_geometry import viewport_bounds
+
+# bump whenever the results layout changes
+RESULTS_FORMAT = 1
+# a stage regressed when its median is this much slower than the baseline...
+REGRESSION_RATIO = 1.25
+# ...and slower by at least this many ms, so sub-millisecond noise never fails a run
+REGRESSION_MIN_MS = 1.0
+# what one Streamlit rerun can afford per stage before the app stops feeling interactive
+BUDGETS_MS = {'load_data_warm': 5, 'param_filter': 5, 'euclidean_rec': 20, 'euclidean_rec_filtered': 20,
+              'search': 20, 'main_map_lines': 50, 'output_prep': 50, 'rerun': 200}
+# track lines the overview map is capped at, as in the app
+MAIN_MAP_TRACKS = 2000
+# repeats for the per-query stages, fewer for the one-off stages that scale with the catalog
+REPEAT = 20
+# queries per call for the batched stage
+BATCH = 100
+# stages every later stage depends on, run even when --stages leaves them out
+REQUIRED_STAGES = {'compile_store', 'index_build'}
+# -----------------------------------------------------
+def _summary(times):
+    times = np.asarray(times) * 1000
+    return {'repeat': len(times), 'min_ms': round(float(times.min()), 4),
+            'median_ms': round(float(np.median(times)), 4), 'p95_ms': round(float(np.percentile(times, 95)), 4)}
+
+def timed(fn, inputs):
+    # one call per input, setup outside the clock
+    times = []
+    for arg in inputs:
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    return _summary(times)
+
+def _filters(recommender, rng, n):
+    # random dropdown combinations, a quarter of them with every dropdown left on 'All'
+    regions = [ALL_REGIONS] + list(recommender.filter_index.regions)
+    picks = []
+    for i in range(n):
+        if i % 4 == 0:
+            picks.append((ALL_REGIONS, None, None, None))
+            continue
+        picks.append((regions[rng.integers(len(regions))],) +
+                     tuple(rng.choice([None] + list(BUCKETS[col])) for col in ('time_h', 'length_km', 'totalAscent')))
+    return picks
+
+def _search_terms(recommender, rng, n):
+    # a partial name that lookup() will not match exactly, like a half typed search
+    names = recommender.df['name'].to_numpy()[rng.integers(0, len(recommender), n)]
+    return [' '.join(str(name).split()[:1])[:6] for name in names]
+
+def output_prep(recommender, hike_row, rows):
+    """The data work of hike_summary and output_results, with every card opened, minus the drawing."""
+    df = recommender.df
+    hike = df.iloc[hike_row]
+    str(hike['time_h']).split('.')
+    result_df = recommender.frame(rows)
+    result_rows = tuple(df.index.get_indexer(result_df.index).tolist())
+    points = df.iloc[list(result_rows)][['name', 'lon', 'lat']]
+    for _, row in result_df.iterrows():
+        str(row.iloc[3]).split('.')
+        profile = row['elevationProfile']
+        pd.DataFrame({'Distance (km)': profile[:, 0], 'Elevation (m)': profile[:, 1]})
+    return points
+
+def main_map_lines(recommender, allowed, zoom=6):
+    """The overview map's data: its trailheads, and the track lines visible where it opens."""
+    points = recommender.df.loc[allowed, ['name', 'lon', 'lat']]
+    bounds = viewport_bounds(float(points['lat'].mean()), float(points['lon'].mean()), zoom)
+    _, paths = recommender.viewport(bounds, zoom, mask=allowed, limit=MAIN_MAP_TRACKS)
+    return [np.round(path.astype(np.float64), 5).tolist() for path in paths]
+
+def rerun(recommender, data, hike_row, filters, k=5):
+    """Everything one press of Recommend costs besides drawing, with the indexes already cached."""
+    trail_store.data_version(data)
+    allowed = recommender.param_filter(*filters)
+    main_map_lines(recommender, allowed)
+    recommender.lookup(recommender.df['name'].iloc[hike_row])
+    rows, _ = recommender.recommend(hike_row, k, mask=allowed)
+    return output_prep(recommender, hike_row, rows)
+# -----------------------------------------------------
+def bench_catalog(data, seed=0, repeat=REPEAT, stages=None):
+    """Time each stage of the recommender against one catalog, returning {stage: timings}.
+
+    A stage that runs out of memory is recorded with its error, and the stages that
+    need its output are skipped, so the results show where the design falls over.
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+    wanted = (lambda stage: stages is None or stage in stages or stage in REQUIRED_STAGES)
+
+    def run(stage, fn, inputs):
+        if not wanted(stage):
+            return
+        gc.collect()
+        try:
+            results[stage] = timed(fn, inputs)
+        except MemoryError as err:
+            results[stage] = {'error': f"{type(err).__name__}: {err}"}
+
+    # one-off costs, run once each since they scale with the whole catalog
+    run('csv_read', lambda _: pd.read_csv(data, index_col=0), [None])
+    shutil.rmtree(trail_store.store_root(data), ignore_errors=True)
+    run('compile_store', lambda _: trail_store.compile_store(data), [None])
+
+    def cold(_):
+        trail_store.open_store.cache_clear()
+        trail_store._frame.cache_clear()
+        trail_store.load_frame(data)
+    run('load_data_cold', cold, [None])
+    run('load_data_warm', lambda _: trail_store.load_frame(data), range(repeat))
+    built = []
+    run('index_build', lambda _: built.append(Recommender(data)), [None])
+    if not built:
+        return results
+    recommender = built[0]
+    results['rows'] = len(recommender)
+
+    # per-query costs, each timed over the same seeded inputs every run
+    filters = _filters(recommender, rng, repeat)
+    rows = rng.integers(0, len(recommender), repeat)
+    masks = [recommender.param_filter(*f) for f in filters]
+    run('param_filter', lambda f: recommender.param_filter(*f), filters)
+    run('euclidean_rec', lambda row: recommender.recommend(row, 5), rows)
+    run('euclidean_rec_filtered', lambda args: recommender.recommend(args[0], 5, mask=args[1]), zip(rows, masks))
+    batches = [[{'row': int(row), 'k': 5} for row in rng.integers(0, len(recommender), BATCH)] for _ in range(max(1, repeat // 4))]
+    run('euclidean_rec_batch', lambda queries: recommend_many(recommender, queries), batches)
+    run('search', lambda args: recommender.search(args[0], 5, mask=args[1]),
+        zip(_search_terms(recommender, rng, repeat), masks))
+    run('main_map_lines', lambda mask: main_map_lines(recommender, mask), [m for m in masks if m.any()])
+    results_rows = [recommender.recommend(row, 5)[0] for row in rows]
+    run('output_prep', lambda args: output_prep(recommender, *args), zip(rows, results_rows))
+    run('rerun', lambda args: rerun(recommender, data, *args), zip(rows, filters))
+    return results
+# -----------------------------------------------------
+# results: machine-readable, with enough context to compare runs across commits
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    return {'commit': _git('rev-parse', 'HEAD'), 'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'sklearn': sklearn.__version__, 'machine': platform.machine(), 'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+def over_budget(results):
+    # interactive stages slower than one rerun can afford, per catalog size
+    return [{'size': size, 'stage': stage, 'median_ms': timing['median_ms'], 'budget_ms': BUDGETS_MS[stage]}
+            for size, stages in results['sizes'].items() for stage, timing in stages.items()
+            if stage in BUDGETS_MS and isinstance(timing, dict) and timing.get('median_ms', 0) > BUDGETS_MS[stage]]
+
+def regressions(results, baseline, ratio=REGRESSION_RATIO, min_ms=REGRESSION_MIN_MS):
+    """Stages slower than in `baseline` by more than `ratio` and `min_ms`, or failing where the baseline passed."""
+    found = []
+    for size, stages in results['sizes'].items():
+        for stage, timing in stages.items():
+            before = baseline.get('sizes', {}).get(size, {}).get(stage)
+            if not isinstance(timing, dict) or not isinstance(before, dict) or 'median_ms' not in before:
+                continue
+            if 'error' in timing:
+                found.append({'size': size, 'stage': stage, 'baseline_ms': before['median_ms'], 'error': timing['error']})
+                continue
+            now, then = timing['median_ms'], before['median_ms']
+            if now > then * ratio and now - then > min_ms:
+                found.append({'size': size, 'stage': stage, 'baseline_ms': then, 'median_ms': now,
+                              'ratio': round(now / max(then, 1e-9), 3)})
+    return found
+
+def print_table(results):
+    for size, stages in results['sizes'].items():
+        print(f"{size} ({stages.get('rows', '?')} rows)")
+        for stage, timing in stages.items():
+            if not isinstance(timing, dict):
+                continue
+            if 'error' in timing:
+                print(f"  {stage:>24}: {timing['error']}")
+            else:
+                print(f"  {stage:>24}: {timing['median_ms']:10.2f} ms median  {timing['p95_ms']:10.2f} ms p95")
+
+if __name__ == '__main__':
+    # python trail_bench.py --sizes 3k 100k --out bench.json --baseline bench_main.json
+    parser = argparse.ArgumentParser(description='Benchmark the recommender hot paths on synthetic catalogs.')
+    parser.add_argument('--sizes', nargs='+', default=['3k', '100k'], help=f"any of {', '.join(SIZES)} or a row count")
+    parser.add_argument('--data-dir', default='data/synthetic', help='where generated catalogs are kept between runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--stages', nargs='+', help='only these stages, the store compile and index build always run')
+    parser.add_argument('--out', help='write the results json here')
+    parser.add_argument('--baseline', help='results json from an earlier commit to compare against')
+    parser.add_argument('--ratio', type=float, default=REGRESSION_RATIO)
+    args = parser.parse_args()
+
+    results = {'format': RESULTS_FORMAT, 'seed': args.seed, 'environment': environment(), 'sizes': {}}
+    for size in args.sizes:
+        data = ensure_catalog(args.data_dir, SIZES.get(size) or int(size), args.seed)
+        results['sizes'][size] = bench_catalog(data, seed=args.seed, repeat=args.repeat, stages=args.stages)
+    results['over_budget'] = over_budget(results)
+    print_table(results)
+    for item in results['over_budget']:
+        print(f"over budget: {item['stage']} at {item['size']}, {item['median_ms']:.1f} ms > {item['budget_ms']} ms")
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = regressions(results, json.load(f), ratio=args.ratio)
+        for item in results['regressions']:
+            print(f"regression: {item['stage']} at {item['size']}, "
+                  f"{item.get('median_ms', item.get('error'))} vs {item['baseline_ms']} ms")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+    sys.exit(1 if results.get('regressions') else 0)
@@ -0,0 +1,232 @@
+import os
+import numpy as np
+
+# zoom levels a simplified copy of every track is kept for, coarsest first -- past the last the raw track is used
+ZOOM_LEVELS = (6, 8, 10, 12)
+# how far (in screen pixels) a simplified line may stray from the recorded track at its zoom
+TOLERANCE_PX = 1.0
+# trails smaller than this on screen are left to the trailhead markers
+MIN_EXTENT_PX = 2.0
+# ground metres per screen pixel at zoom 0 on the equator, in the 512px tile convention deck.gl and mapbox use
+ZOOM0_M_PER_PX = 78271.517
+# the tolerances are worked out at roughly the middle of New Zealand
+REFERENCE_LAT = -41.5
+M_PER_DEG = 111_320.0
+# grid cell size of the viewport index, in degrees
+GRID_DEG = 0.25
+# canvas a map is assumed to fill when working out what it shows, st.pydeck_chart is 500px high
+VIEW_WIDTH_PX = 1000
+VIEW_HEIGHT_PX = 500
+# -----------------------------------------------------
+# zoom arithmetic
+def tolerance_m(zoom, tolerance_px=TOLERANCE_PX):
+    return tolerance_px * ZOOM0_M_PER_PX * np.cos(np.radians(REFERENCE_LAT)) / 2 ** zoom
+
+def degrees_per_px(zoom):
+    # longitude degrees per pixel -- latitude degrees shrink by cos(lat)
+    return 360.0 / (512 * 2 ** zoom)
+
+def viewport_bounds(lat, lon, zoom, width_px=VIEW_WIDTH_PX, height_px=VIEW_HEIGHT_PX):
+    """(west, south, east, north) a map centred on (lat, lon) at `zoom` shows."""
+    half_lon = width_px / 2 * degrees_per_px(zoom)
+    half_lat = height_px / 2 * degrees_per_px(zoom) * np.cos(np.radians(lat))
+    west, east = lon - half_lon, lon + half_lon
+    # wrap across the antimeridian, the Chatham Islands sit just east of it
+    west = west + 360 if west < -180 else west
+    east = east - 360 if east > 180 else east
+    return float(west), float(max(lat - half_lat, -90)), float(east), float(min(lat + half_lat, 90))
+# -----------------------------------------------------
+# line simplification, every trail at once
+def project(points):
+    # (lon, lat) degrees -> local metres, good enough over the length of one track
+    points = np.asarray(points, dtype=np.float64)
+    return np.column_stack([points[:, 0] * np.cos(np.radians(points[:, 1])) * M_PER_DEG, points[:, 1] * M_PER_DEG])
+
+def douglas_peucker(xy, offsets, tolerance):
+    """Keep mask over the packed points of every trail, Douglas-Peucker with `tolerance` in xy units.
+
+    Rather than recursing trail by trail, each pass splits every open segment of
+    every trail at its farthest point, so the passes scale with the depth of the
+    recursion and not with the number of trails.
+    """
+    counts = np.diff(offsets)
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[offsets[:-1][counts > 0]] = True
+    keep[offsets[1:][counts > 0] - 1] = True
+    a, b = offsets[:-1][counts > 2], offsets[1:][counts > 2] - 1
+    while len(a):
+        inner = b - a - 1
+        starts = np.zeros(len(a) + 1, dtype=np.int64)
+        starts[1:] = np.cumsum(inner)
+        seg = np.repeat(np.arange(len(a)), inner)
+        idx = np.arange(starts[-1]) - starts[:-1][seg] + a[seg] + 1
+        # distance to the segment a-b, clamped so loop tracks (a == b) measure from the trailhead
+        pa, ab = xy[a][seg], (xy[b] - xy[a])[seg]
+        ap = xy[idx] - pa
+        denom = (ab ** 2).sum(axis=1)
+        t = np.clip(np.divide((ap * ab).sum(axis=1), denom, out=np.zeros_like(denom), where=denom > 0), 0, 1)
+        dist = np.hypot(*(ap - t[:, None] * ab).T)
+        seg_max = np.maximum.reduceat(dist, starts[:-1])
+        # first point at the maximum in each segment
+        at_max = np.flatnonzero(dist == seg_max[seg])
+        far = idx[at_max[np.unique(seg[at_max], return_index=True)[1]]]
+        split = seg_max > tolerance
+        keep[far[split]] = True
+        a, b = np.concatenate([a[split], far[split]]), np.concatenate([far[split], b[split]])
+        a, b = a[b - a > 1], b[b - a > 1]
+    return keep
+
+def simplify_levels(values, offsets, zoom_levels=ZOOM_LEVELS, tolerance_px=TOLERANCE_PX):
+    # {zoom: (values, offsets)}, each coarser level simplified from the finer one before it
+    levels = {}
+    values, offsets = np.asarray(values, dtype=np.float32), np.asarray(offsets, dtype=np.int64)
+    for zoom in sorted(zoom_levels, reverse=True):
+        keep = douglas_peucker(project(values), offsets, tolerance_m(zoom, tolerance_px))
+        kept = np.zeros(len(values) + 1, dtype=np.int64)
+        kept[1:] = np.cumsum(keep)
+        values, offsets = values[keep], kept[offsets]
+        levels[zoom] = (values, offsets)
+    return levels
+
+def bounding_boxes(values, offsets, lon, lat):
+    # (west, south, east, north) of every track, the trailhead for trails without one
+    counts = np.diff(offsets)
+    bbox = np.column_stack([lon, lat, lon, lat]).astype(np.float32)
+    has = np.flatnonzero(counts > 0)
+    if len(has):
+        starts = offsets[:-1][has]
+        for col, (axis, reduce) in enumerate([(0, np.minimum), (1, np.minimum), (0, np.maximum), (1, np.maximum)]):
+            bbox[has, col] = reduce.reduceat(values[:, axis], starts)
+    return bbox
+
+def build_geometry(values, offsets, lon, lat, out_dir):
+    """Write the per-zoom simplified tracks and bounding boxes into a store directory.
+
+    Called by trail_store.compile_store, returns what goes into the manifest.
+    """
+    np.save(os.path.join(out_dir, 'geometry.bbox.npy'), bounding_boxes(values, offsets, lon, lat))
+    points = {}
+    for zoom, (level_values, level_offsets) in simplify_levels(values, offsets).items():
+        np.save(os.path.join(out_dir, f"geometry.z{zoom}.values.npy"), level_values)
+        np.save(os.path.join(out_dir, f"geometry.z{zoom}.offsets.npy"), level_offsets)
+        points[zoom] = len(level_values)
+    return {'levels': sorted(points), 'points': {str(z): n for z, n in sorted(points.items())},
+            'raw_points': len(values), 'tolerance_px': TOLERANCE_PX}
+# -----------------------------------------------------
+# bounding box grid: every trail is listed in each cell its box overlaps
+class GridIndex:
+    def __init__(self, bbox, cell_deg=GRID_DEG):
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.cell_deg = cell_deg
+        n = len(self.bbox)
+        self.origin = self.bbox[:, :2].min(axis=0).astype(np.float64) if n else np.zeros(2)
+        x0, y0 = self._cell(self.bbox[:, 0], 0), self._cell(self.bbox[:, 1], 1)
+        x1, y1 = self._cell(self.bbox[:, 2], 0), self._cell(self.bbox[:, 3], 1)
+        self.nx, self.ny = (int(x1.max()) + 1, int(y1.max()) + 1) if n else (1, 1)
+        # one (trail, cell) pair per cell a box covers, most tracks cover one to four
+        wide, high = x1 - x0 + 1, y1 - y0 + 1
+        per_trail = wide * high
+        trail = np.repeat(np.arange(n), per_trail)
+        k = np.arange(per_trail.sum()) - np.repeat(np.cumsum(per_trail) - per_trail, per_trail)
+        cell = (x0[trail] + k % wide[trail]) * self.ny + y0[trail] + k // wide[trail]
+        order = np.argsort(cell, kind='stable')
+        self.rows = trail[order].astype(np.int32)
+        self.offsets = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(cell, minlength=self.nx * self.ny))
+
+    def _cell(self, coord, axis):
+        return np.floor((np.asarray(coord, dtype=np.float64) - self.origin[axis]) / self.cell_deg).astype(np.int64)
+
+    def query(self, west, south, east, north):
+        """Sorted rows whose bounding box overlaps the box, which may cross the antimeridian (west > east)."""
+        if not np.isfinite([west, south, east, north]).all():
+            # a map centred on the average of no trails at all
+            return np.empty(0, dtype=np.intp)
+        if west > east:
+            return np.union1d(self.query(west, south, 180.0, north), self.query(-180.0, south, east, north))
+        x0, x1 = np.clip([self._cell(west, 0), self._cell(east, 0)], 0, self.nx - 1)
+        y0, y1 = np.clip([self._cell(south, 1), self._cell(north, 1)], 0, self.ny - 1)
+        # cells of one grid column are contiguous, so each column is a single slice
+        parts = [self.rows[self.offsets[x * self.ny + y0]:self.offsets[x * self.ny + y1 + 1]] for x in range(x0, x1 + 1)]
+        rows = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+        box = self.bbox[rows]
+        hit = (box[:, 0] <= east) & (box[:, 2] >= west) & (box[:, 1] <= north) & (box[:, 3] >= south)
+        return rows[hit].astype(np.intp)
+# -----------------------------------------------------
+# the compiled geometry of one dataset version
+class GeometryStore:
+    """Track lines at several levels of detail, and which ones a viewport shows.
+
+    Each level is a packed float32 (lon, lat) array with offsets, memory mapped
+    from the store directory like the ragged columns; the raw tracks serve zooms
+    past the finest level.
+    """
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        load = (lambda name: np.load(os.path.join(path, name), mmap_mode='r'))
+        self.levels = {zoom: (load(f"geometry.z{zoom}.values.npy"), load(f"geometry.z{zoom}.offsets.npy"))
+                       for zoom in meta['levels']}
+        self.raw = (load('coordinates.values.npy'), load('coordinates.offsets.npy'))
+        self.bbox = np.asarray(load('geometry.bbox.npy'))
+        self.grid = GridIndex(self.bbox)
+
+    @classmethod
+    def open(cls, path, manifest):
+        # None for a store compiled without track coordinates
+        return cls(path, manifest['geometry']) if 'geometry' in manifest else None
+
+    def __len__(self):
+        return len(self.bbox)
+
+    def level(self, zoom):
+        # the coarsest level still accurate at `zoom`, None for the raw tracks
+        return next((z for z in sorted(self.levels) if z >= int(zoom)), None)
+
+    def paths(self, rows, zoom):
+        """(n, 2) float32 (lon, lat) arrays for `rows`, at the detail `zoom` needs."""
+        level = self.level(zoom)
+        values, offsets = self.levels[level] if level is not None else self.raw
+        return [np.asarray(values[offsets[r]:offsets[r+1]]) for r in rows]
+
+    def visible(self, bounds, zoom, mask=None, limit=None):
+        """Rows of the trails drawn as lines in the viewport `bounds` at `zoom`.
+
+        Trails too small to see at that zoom are left out, and with `limit` only
+        the largest on screen are kept. Rows come back in ascending order.
+        """
+        rows = self.grid.query(*bounds)
+        if mask is not None:
+            rows = rows[mask[rows]]
+        box = self.bbox[rows].astype(np.float64)
+        extent = np.maximum(box[:, 2] - box[:, 0], (box[:, 3] - box[:, 1]) / np.cos(np.radians(box[:, 1])))
+        big = extent / degrees_per_px(zoom) >= MIN_EXTENT_PX
+        rows, extent = rows[big], extent[big]
+        if limit is not None and len(rows) > limit:
+            rows = np.sort(rows[np.lexsort((rows, -extent))[:limit]])
+        return rows
+# -----------------------------------------------------
+# Google encoded polylines, about a quarter of the JSON a coordinate list takes
+def encode_polyline(points, precision=5):
+    # (lon, lat) rows in, the format itself puts latitude first
+    scaled = np.round(np.asarray(points, dtype=np.float64)[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    chars = []
+    for value in np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+def decode_polyline(text, precision=5):
+    # inverse of encode_polyline, back to (lon, lat) rows
+    values, value, shift = [], 0, 0
+    for char in text:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    return (np.cumsum(np.reshape(values, (-1, 2)), axis=0) / 10 ** precision)[:, ::-1]
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import cProfile
+import threading
+import contextlib
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# histogram buckets for stage timings (seconds) and payloads handed to pydeck / Altair (bytes)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20, 64 << 20)
+HELP = {
+    'trail_stage_seconds': 'Time spent in each stage of a rerun or service request.',
+    'trail_payload_bytes': 'Size of the JSON spec handed to pydeck or Altair.',
+    'trail_search_path_total': 'Recommend presses answered by an exact name match or by the fallback name search.',
+    'trail_service_queries_total': 'Queries answered by the recommender service, per endpoint.',
+    'trail_service_errors_total': 'Service requests rejected as malformed, per endpoint and exception type.',
+}
+# reruns whose spans are kept for the JSON export
+RECENT_RERUNS = 50
+# .prof files kept by the per-rerun profiler, oldest deleted first
+KEEP_PROFILES = 20
+# -----------------------------------------------------
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+# -----------------------------------------------------
+# process-wide registry -- Streamlit re-executes the app script on every rerun, but imported modules stay put
+class Metrics:
+    """Counters and histograms for the app and the service, exportable as Prometheus text or JSON."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.recent = deque(maxlen=RECENT_RERUNS)
+        self._local = threading.local()
+        # payload sizes mean serializing the spec a second time, so they are only measured when someone is exporting
+        self.measure_payloads = False
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        # time one stage, and note it on the current rerun's trace if one is open
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe('trail_stage_seconds', seconds, stage=stage)
+            trace = getattr(self._local, 'trace', None)
+            if trace is not None:
+                trace['spans'].append({'stage': stage, 'ms': round(seconds * 1000, 3)})
+
+    @contextlib.contextmanager
+    def rerun(self, name='rerun'):
+        # one trace per Streamlit rerun or service request, the whole thing timed as its own stage
+        self._local.trace = {'started': time.time(), 'name': name, 'spans': []}
+        try:
+            with self.span(name):
+                yield
+        finally:
+            self.recent.append(self._local.trace)
+            self._local.trace = None
+
+    def payload(self, target, spec):
+        # bytes of JSON a chart or map spec turns into, `spec` being anything with to_json()
+        if self.measure_payloads:
+            self.observe('trail_payload_bytes', len(spec.to_json()), buckets=BYTES_BUCKETS, target=target)
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+                lines += [f"{name}{{{_labels(labels)}}} {value}" for (n, labels), value in sorted(self.counters.items()) if n == name]
+            for name in sorted({name for name, _ in self.histograms}):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+                for (n, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append(f"{name}_bucket{{{_labels(labels + (('le', bound),))}}} {count}")
+                    lines.append(f"{name}_bucket{{{_labels(labels + (('le', '+Inf'),))}}} {hist.count}")
+                    lines.append(f"{name}_sum{{{_labels(labels)}}} {hist.sum}")
+                    lines.append(f"{name}_count{{{_labels(labels)}}} {hist.count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        with self.lock:
+            return {'counters': [{'name': n, 'labels': dict(labels), 'value': v} for (n, labels), v in self.counters.items()],
+                    'histograms': [{'name': n, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                                    'buckets': dict(zip(map(str, h.buckets), h.counts))}
+                                   for (n, labels), h in self.histograms.items()],
+                    'recent': list(self.recent)}
+
+    def write(self, path):
+        # .json gets the full dump with recent traces, anything else Prometheus text (node exporter textfile style)
+        body = json.dumps(self.to_dict(), indent=1) if path.endswith('.json') else self.to_prometheus()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+# -----------------------------------------------------
+# Prometheus scrape endpoint, one per process
+def send_prometheus(handler):
+    # answer a GET on any BaseHTTPRequestHandler with the current metrics
+    body = METRICS.to_prometheus().encode()
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        send_prometheus(self)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def serve(port, host='127.0.0.1'):
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            METRICS.measure_payloads = True
+    return _server
+# -----------------------------------------------------
+# optional cProfile of a whole rerun, one .prof file each (snakeviz / pstats to read them)
+# only one profiler can be active per process, a rerun from a second session meanwhile goes unprofiled
+_profile_lock = threading.Lock()
+
+@contextlib.contextmanager
+def profiled(out_dir, keep=KEEP_PROFILES):
+    if not out_dir or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        _profile_lock.release()
+        os.makedirs(out_dir, exist_ok=True)
+        profile.dump_stats(os.path.join(out_dir, f"rerun-{time.time_ns()}-{os.getpid()}.prof"))
+        stale = sorted(f for f in os.listdir(out_dir) if f.startswith('rerun-') and f.endswith('.prof'))[:-keep]
+        for filename in stale:
+            os.remove(os.path.join(out_dir, filename))
+# -----------------------------------------------------
+# the app's export settings come from the environment, the service serves /metrics itself
+#   TRAIL_METRICS_FILE  written after every rerun (.json for a full dump, otherwise Prometheus text)
+#   TRAIL_METRICS_PORT  serve Prometheus text on http://127.0.0.1:<port>/metrics
+#   TRAIL_PROFILE_DIR   cProfile every rerun into this directory
+METRICS = Metrics()
+
+def settings():
+    port = os.environ.get('TRAIL_METRICS_PORT')
+    return {'file': os.environ.get('TRAIL_METRICS_FILE'), 'port': int(port) if port else None,
+            'profile_dir': os.environ.get('TRAIL_PROFILE_DIR')}
+
+def configure():
+    """Start whichever exports the environment asks for, safe to call on every rerun."""
+    config = settings()
+    if config['port']:
+        serve(config['port'])
+    if config['file']:
+        METRICS.measure_payloads = True
+    return config
+
+def export(config):
+    if config['file']:
+        METRICS.write(config['file'])
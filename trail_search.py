@@ -0,0 +1,99 @@
+import re
+import bisect
+import unicodedata
+import numpy as np
+
+# abbreviations used in the scraped names, spelled out so either form matches
+ABBREVIATIONS = {'tk': 'track', 'trk': 'track'}
+# -----------------------------------------------------
+# normalisation shared by the index and the queries
+def normalize(text):
+    # fold macrons (Kōhaihai -> kohaihai), lowercase, drop punctuation, expand abbreviations
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    words = re.findall(r'[a-z0-9]+', text)
+    return ' '.join(ABBREVIATIONS.get(w, w) for w in words)
+
+def trigrams(normalized):
+    # padded so word starts and ends get their own trigrams
+    padded = f"  {normalized} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+# -----------------------------------------------------
+# character trigram inverted index over trail names, built once per dataset version
+class TrailSearchIndex:
+    def __init__(self, names, min_coverage=0.4):
+        self.names = list(names)
+        self.n = len(self.names)
+        self.normalized = [normalize(name) for name in self.names]
+        # a query has to share at least this fraction of its trigrams with a name to match
+        self.min_coverage = min_coverage
+        # exact lookups on the normalized name, first row wins for duplicates
+        self._exact = {}
+        for row, name in enumerate(self.normalized):
+            self._exact.setdefault(name, row)
+        # trigram -> sorted array of row ids
+        postings = {}
+        self.gram_counts = np.zeros(self.n, dtype=np.int32)
+        for row, name in enumerate(self.normalized):
+            grams = trigrams(name)
+            self.gram_counts[row] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+        self.postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+        # every word-start suffix of every name, sorted for prefix autocomplete
+        suffixes = []
+        for row, name in enumerate(self.normalized):
+            for match in re.finditer(r'\S+', name):
+                suffixes.append((name[match.start():], row))
+        suffixes.sort()
+        self._suffixes = [s for s, _ in suffixes]
+        self._suffix_rows = np.array([row for _, row in suffixes], dtype=np.int32)
+
+    def lookup(self, query):
+        # row id of the trail whose name matches the query after normalisation, or None
+        return self._exact.get(normalize(query))
+
+    def search(self, query, limit=10, mask=None):
+        """Ranked fuzzy matches for `query` as an array of row ids.
+
+        Rows are scored on how many of the query's trigrams they contain, with a
+        boost for names that start with or contain the whole query. An empty query
+        returns the first `limit` rows in dataset (alphabetical) order.
+        """
+        query = normalize(query)
+        allowed = np.ones(self.n, dtype=bool) if mask is None else mask
+        if not query:
+            return np.flatnonzero(allowed)[:limit]
+        grams = [g for g in trigrams(query) if g in self.postings]
+        n_grams = len(trigrams(query))
+        if not grams:
+            return np.empty(0, dtype=np.intp)
+        shared = np.bincount(np.concatenate([self.postings[g] for g in grams]), minlength=self.n)
+        coverage = shared / n_grams
+        dice = 2 * shared / (n_grams + self.gram_counts)
+        score = 0.7 * coverage + 0.3 * dice
+        candidates = np.flatnonzero((coverage >= self.min_coverage) & allowed)
+        if len(candidates) > limit * 4:
+            candidates = candidates[np.argpartition(-score[candidates], limit * 4)[:limit * 4]]
+        # whole-query boosts only need checking on the shortlist
+        boosted = []
+        for row in candidates:
+            name = self.normalized[row]
+            boost = 1.0 if name.startswith(query) else 0.5 if query in name else 0.0
+            boosted.append((-(score[row] + boost), row))
+        boosted.sort()
+        return np.array([row for _, row in boosted[:limit]], dtype=np.intp)
+
+    def autocomplete(self, prefix, limit=10, mask=None):
+        # names with a word starting with prefix, names starting with it first
+        prefix = normalize(prefix)
+        if not prefix:
+            return np.empty(0, dtype=np.intp)
+        lo = bisect.bisect_left(self._suffixes, prefix)
+        hi = bisect.bisect_left(self._suffixes, prefix + '\uffff')
+        rows = self._suffix_rows[lo:hi]
+        if mask is not None:
+            rows = rows[mask[rows]]
+        rows = np.unique(rows)
+        starts = np.array([self.normalized[row].startswith(prefix) for row in rows], dtype=bool)
+        return np.concatenate([rows[starts], rows[~starts]])[:limit]
@@ -0,0 +1,256 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import hashlib
+import functools
+import numpy as np
+import pandas as pd
+from elevation_profiles import climb_metrics, downsample_profiles
+from trail_geometry import build_geometry
+from record_linkage import SOURCE_FILES, enrich, load_sources
+
+# bump whenever the on-disk layout changes so stale stores get rebuilt
+FORMAT_VERSION = 5
+# text columns that are stored as categorical codes instead of strings
+CATEGORY_COLS = ('region','type','docStatus','docObjectType','docDifficulty')
+# compiled versions kept per csv, older ones are deleted after each compile
+KEEP_VERSIONS = 3
+# text blobs that are parsed into ragged float32 arrays, with the number of values per point
+RAGGED_COLS = {'coordinates': 2, 'trackElevation': 1}
+# -----------------------------------------------------
+# versioning -- a store is tied to the exact csv and DOC exports it was compiled from
+def source_version(csv_path):
+    data_dir = os.path.dirname(csv_path)
+    sources = [csv_path] + [os.path.join(data_dir, f) for f in SOURCE_FILES.values()]
+    stats = [(path, os.stat(path)) for path in sources if os.path.exists(path)]
+    digest = hashlib.sha1('|'.join(f"{os.path.basename(p)}:{st.st_mtime_ns}:{st.st_size}" for p, st in stats).encode())
+    # csv mtime first so versions still sort oldest to newest
+    return f"{stats[0][1].st_mtime_ns}-{digest.hexdigest()[:12]}"
+
+def store_root(csv_path):
+    return os.path.splitext(csv_path)[0] + '.store'
+
+def store_path(csv_path, version=None):
+    version = version or source_version(csv_path)
+    return os.path.join(store_root(csv_path), f"v{FORMAT_VERSION}-{version}")
+# -----------------------------------------------------
+# parsing of the scraped text blobs
+def parse_floats(text):
+    # scraped arrays look like '173.09,-41.49"," 173.10,-41.50' or '12.5,13.0,14.2'
+    if not isinstance(text, str):
+        return np.empty(0, dtype=np.float32)
+    return np.fromstring(text.replace('"', ' ').replace(',', ' '), dtype=np.float32, sep=' ')
+
+def pack_ragged(texts, width):
+    # concatenate every row into one values array, row i lives in values[offsets[i]:offsets[i+1]]
+    parts = []
+    for text in texts:
+        values = parse_floats(text)
+        if width > 1:
+            values = values[:len(values) - len(values) % width].reshape(-1, width)
+        parts.append(values)
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in parts])
+    values = np.concatenate(parts) if parts else np.empty((0, width) if width > 1 else 0, dtype=np.float32)
+    return values.astype(np.float32), offsets
+
+def ragged_rows(values, offsets):
+    # zero-copy views into the memory map, one per row
+    return [values[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+# -----------------------------------------------------
+# build step: csv -> versioned directory of .npy files
+def compile_store(csv_path, out_dir=None):
+    version = source_version(csv_path)
+    out_dir = out_dir or store_path(csv_path, version)
+    if os.path.exists(os.path.join(out_dir, 'manifest.json')):
+        return out_dir
+    df = pd.read_csv(csv_path, index_col=0)
+    # enrichment stage: DOC status, type and difficulty linked onto each track
+    linked, linkage = enrich(df, **load_sources(os.path.dirname(csv_path)))
+    for col, values in linked.items():
+        df[col] = values
+    os.makedirs(os.path.dirname(out_dir), exist_ok=True)
+    # write into a scratch directory first so readers never see a half written store
+    tmp_dir = tempfile.mkdtemp(prefix='.building-', dir=os.path.dirname(out_dir))
+    columns = []
+    ragged = {}
+    for col in df.columns:
+        series = df[col]
+        if col in RAGGED_COLS:
+            values, offsets = ragged[col] = pack_ragged(series.tolist(), RAGGED_COLS[col])
+            np.save(os.path.join(tmp_dir, f"{col}.values.npy"), values)
+            np.save(os.path.join(tmp_dir, f"{col}.offsets.npy"), offsets)
+            columns.append({'name': col, 'kind': 'ragged', 'width': RAGGED_COLS[col]})
+        elif col in CATEGORY_COLS:
+            cat = pd.Categorical(series.astype(str))
+            np.save(os.path.join(tmp_dir, f"{col}.codes.npy"), cat.codes.astype(np.int16))
+            columns.append({'name': col, 'kind': 'category', 'categories': [str(c) for c in cat.categories]})
+        elif pd.api.types.is_numeric_dtype(series):
+            np.save(os.path.join(tmp_dir, f"{col}.npy"), series.to_numpy(dtype=np.float32))
+            columns.append({'name': col, 'kind': 'float32'})
+        else:
+            # free text, stored as one NUL separated utf-8 blob
+            with open(os.path.join(tmp_dir, f"{col}.txt"), 'wb') as f:
+                f.write('\0'.join(series.astype(str).tolist()).encode('utf-8'))
+            columns.append({'name': col, 'kind': 'string'})
+    if 'trackElevation' in ragged and 'length_km' in df.columns:
+        # derived at build time: climb metrics and a chart sized (distance, elevation) profile per trail
+        values, offsets = ragged['trackElevation']
+        length_km = df['length_km'].to_numpy(dtype=np.float64)
+        for col, metric in climb_metrics(values, offsets, length_km).items():
+            np.save(os.path.join(tmp_dir, f"{col}.npy"), metric)
+            columns.append({'name': col, 'kind': 'float32', 'derived': True})
+        values, offsets = downsample_profiles(values, offsets, length_km)
+        np.save(os.path.join(tmp_dir, 'elevationProfile.values.npy'), values)
+        np.save(os.path.join(tmp_dir, 'elevationProfile.offsets.npy'), offsets)
+        columns.append({'name': 'elevationProfile', 'kind': 'ragged', 'width': 2, 'derived': True})
+    np.save(os.path.join(tmp_dir, 'index.npy'), df.index.to_numpy(dtype=np.int64))
+    manifest = {'format': FORMAT_VERSION, 'source': os.path.basename(csv_path), 'source_version': version,
+                'rows': len(df), 'index_name': df.index.name, 'columns': columns, 'linkage': linkage}
+    if 'coordinates' in ragged and {'lon', 'lat'} <= set(df.columns):
+        # derived at build time: map lines simplified per zoom level, and the boxes the viewport index is built on
+        values, offsets = ragged['coordinates']
+        manifest['geometry'] = build_geometry(values, offsets, df['lon'].to_numpy(), df['lat'].to_numpy(), tmp_dir)
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    try:
+        os.rename(tmp_dir, out_dir)
+    except OSError:
+        # another process finished compiling the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        if os.path.dirname(out_dir) == store_root(csv_path):
+            prune_stores(csv_path)
+    return out_dir
+
+def _build_order(name):
+    # 'v4-<csv mtime>-<digest>' -> (4, '<csv mtime>-<digest>'), oldest to newest
+    format_version, _, version = name.partition('-')
+    return int(format_version[1:]), version
+
+def prune_stores(csv_path, keep=KEEP_VERSIONS):
+    """Delete all but the newest `keep` compiled versions of csv_path, returning what was removed.
+
+    Every version carries its own geometry, neighbour table and IVF index, so
+    without this each refresh of the csv or the DOC exports grows the disk use.
+    The newest older version with an IVF index is kept too when none of the kept
+    ones has one, since ann_index.build_ann extends it instead of retraining.
+    """
+    root = store_root(csv_path)
+    builds = sorted((d for d in os.listdir(root) if re.fullmatch(r'v\d+-.+', d) and os.path.isdir(os.path.join(root, d))),
+                    key=_build_order)
+    kept, stale = builds[-keep:], builds[:-keep]
+    has_ann = (lambda build: os.path.exists(os.path.join(root, build, 'ann.json')))
+    if not any(has_ann(build) for build in kept):
+        stale = [build for build in stale if build != next((b for b in reversed(stale) if has_ann(b)), None)]
+    for build in stale:
+        # a process still reading an old version keeps its memory maps, the files go once it lets go of them
+        shutil.rmtree(os.path.join(root, build), ignore_errors=True)
+    return [os.path.join(root, build) for build in stale]
+# -----------------------------------------------------
+# loading: memory map a compiled store
+class TrailStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['source_version']
+        self.index = self._load('index.npy')
+        self.ragged = {}
+        self.columns = {}
+        for col in self.manifest['columns']:
+            name, kind = col['name'], col['kind']
+            if kind == 'float32':
+                self.columns[name] = self._load(f"{name}.npy")
+            elif kind == 'category':
+                codes = self._load(f"{name}.codes.npy")
+                self.columns[name] = pd.Categorical.from_codes(codes, categories=col['categories'])
+            elif kind == 'string':
+                with open(os.path.join(path, f"{name}.txt"), 'rb') as f:
+                    text = f.read().decode('utf-8')
+                self.columns[name] = np.array(text.split('\0') if self.manifest['rows'] else [], dtype=object)
+            elif kind == 'ragged':
+                self.ragged[name] = (self._load(f"{name}.values.npy"), self._load(f"{name}.offsets.npy"))
+                self.columns[name] = ragged_rows(*self.ragged[name])
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.path, filename), mmap_mode='r')
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def to_frame(self):
+        # ragged columns hold float32 array views, numeric columns stay backed by the memory map
+        df = pd.DataFrame({col['name']: self.columns[col['name']] for col in self.manifest['columns']},
+                          index=pd.Index(self.index, name=self.manifest['index_name']), copy=False)
+        return df
+
+@functools.lru_cache(maxsize=4)
+def open_store(path):
+    return TrailStore(path)
+
+@functools.lru_cache(maxsize=4)
+def _frame(path):
+    return open_store(path).to_frame()
+
+def resolve_store(csv_path):
+    # compiled store for csv_path, compiling it on first use and whenever the csv changes
+    if os.path.exists(csv_path):
+        path = store_path(csv_path)
+        if not os.path.exists(os.path.join(path, 'manifest.json')):
+            compile_store(csv_path, path)
+        return path
+    # deployed without the csv, use the newest compiled store
+    root = store_root(csv_path)
+    builds = sorted(d for d in os.listdir(root) if d.startswith(f"v{FORMAT_VERSION}-"))
+    return os.path.join(root, builds[-1])
+
+def load_frame(csv_path):
+    """DataFrame for `csv_path`, served from its memory-mapped compiled store.
+
+    Within a process the frame is built once per store version and shared, so
+    callers must treat it as read-only.
+    """
+    return _frame(resolve_store(csv_path))
+
+def data_version(csv_path):
+    # version of the dataset load_frame serves, used to key anything derived from it
+    return open_store(resolve_store(csv_path)).version
+# -----------------------------------------------------
+# load time comparison against parsing the csv
+def bench(csv_path, repeat=5):
+    timings = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        pd.read_csv(csv_path, index_col=0)
+    timings['csv_read'] = (time.perf_counter() - start) / repeat
+
+    shutil.rmtree(store_path(csv_path), ignore_errors=True)
+    start = time.perf_counter()
+    compile_store(csv_path)
+    timings['compile'] = time.perf_counter() - start
+
+    # cold: nothing cached in this process yet, warm: served from the per-version cache
+    open_store.cache_clear()
+    _frame.cache_clear()
+    start = time.perf_counter()
+    load_frame(csv_path)
+    timings['store_cold'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        load_frame(csv_path)
+    timings['store_warm'] = (time.perf_counter() - start) / repeat
+    return timings
+
+if __name__ == '__main__':
+    # python trail_store.py data/WalkingKiwi_Tracks5.csv [--bench]
+    csv_path = sys.argv[1]
+    if '--bench' in sys.argv[2:]:
+        for stage, seconds in bench(csv_path).items():
+            print(f"{stage:>12}: {seconds*1000:9.2f} ms")
+    else:
+        print(compile_store(csv_path))